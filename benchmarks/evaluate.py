@@ -0,0 +1,102 @@
+"""
+Batch cart evaluation benchmark
+
+Compares the throughput of pricing carts with the vectorized batch path
+against pricing them one at a time in a Python loop
+
+Usage:
+    python -m benchmarks.evaluate --carts 1000000 --promotions 1000
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date
+import numpy as np
+from service.engine import ActivePromotions
+
+
+def make_promotions(count: int) -> list:
+    """Makes serialized active Promotions with random discounts"""
+    promotions = []
+    for id_ in range(1, count + 1):
+        percent = random.random() < 0.5
+        promotions.append({
+            "id": id_,
+            "type": "PERCENT_DISCOUNT" if percent else "ABS_DISCOUNT",
+            "promotion_value": None if percent else random.randint(1, 2000),
+            "promotion_percent": random.randint(1, 75) if percent else None,
+        })
+    return promotions
+
+
+def naive_loop(promotions: list, totals) -> list:
+    """Prices each cart by trying every Promotion on it"""
+    discounts = []
+    for total in totals:
+        best = 0.0
+        for promotion in promotions:
+            if promotion["type"] == "ABS_DISCOUNT":
+                discount = min(float(promotion["promotion_value"]), total)
+            else:
+                discount = min(total * promotion["promotion_percent"] / 100, total)
+            best = max(best, discount)
+        discounts.append(round(best, 2))
+    return discounts
+
+
+def timed(function, *args):
+    """Returns the seconds a call takes and its result"""
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def run(carts: int, promotion_count: int, naive_carts: int) -> dict:
+    """Runs the benchmark and returns the carts priced per second by each path"""
+    random.seed(42)
+    promotions = make_promotions(promotion_count)
+    active = ActivePromotions(date.today())
+    for promotion in promotions:
+        active.add(promotion)
+    totals = np.random.default_rng(42).uniform(0, 5000, carts).round(2)
+    sample = totals[:naive_carts].tolist()
+
+    naive_seconds, naive = timed(naive_loop, promotions, sample)
+    loop_seconds, loop = timed(lambda: [active.best_for(total)[1] for total in totals.tolist()])
+    vector_seconds, (vector, _) = timed(active.best_for_totals, totals)
+
+    assert np.allclose(vector[:naive_carts], naive)
+    assert np.allclose(vector, loop)
+    return {
+        "carts": carts,
+        "promotions": promotion_count,
+        "naive_carts_per_second": len(sample) / naive_seconds,
+        "loop_carts_per_second": carts / loop_seconds,
+        "vectorized_carts_per_second": carts / vector_seconds,
+    }
+
+
+def main():
+    """Parses the command line and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carts", type=int, default=1_000_000)
+    parser.add_argument("--promotions", type=int, default=1000)
+    parser.add_argument("--naive-carts", type=int, default=2000,
+                        help="carts priced by the naive loop, which is too slow for all of them")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    results = run(args.carts, args.promotions, min(args.naive_carts, args.carts))
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(f"{results['carts']} carts against {results['promotions']} active promotions")
+    for name in ("naive", "loop", "vectorized"):
+        rate = results[f"{name}_carts_per_second"]
+        print(f"  {name:<12}{rate:>16,.0f} carts/s"
+              f"{rate / results['naive_carts_per_second']:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Payload size benchmark
+
+Encodes lists of 1k, 10k and 100k Promotions the ways the list endpoint
+can send them, JSON or MessagePack, each uncompressed, gzipped and
+brotli compressed at the configured levels, and reports the bytes on the
+wire with the CPU time spent encoding and compressing them. The rows are
+built in memory with PromotionFactory, so no database is needed.
+
+Usage:
+    python -m benchmarks.payload
+    python -m benchmarks.payload --sizes 1000,10000 --repeat 5 --json
+"""
+import argparse
+import functools
+import json
+import platform
+import time
+
+
+def cpu_seconds(function, repeat: int):
+    """Returns the result of a function and the mean CPU seconds it took"""
+    result = function()  # warm up
+    start = time.process_time()
+    for _ in range(repeat):
+        function()
+    return result, (time.process_time() - start) / repeat
+
+
+def build_rows(size: int, columns: list, seed: int) -> list:
+    """Returns size row tuples of fake Promotions"""
+    # pylint: disable=import-outside-toplevel
+    import factory.random
+    from tests.factories import PromotionFactory
+
+    factory.random.reseed_random(seed)
+    return [tuple(getattr(promotion, name) for name in columns) for promotion in PromotionFactory.build_batch(size)]
+
+
+def measure(row_encoder, rows: list, encode, settings: dict, repeat: int) -> list:
+    """Returns the bytes and CPU cost of a list encoded in one format with each content coding"""
+    from service.common import compression  # pylint: disable=import-outside-toplevel
+
+    body, encode_seconds = cpu_seconds(functools.partial(encode, row_encoder, rows), repeat)
+    results = [{"encoding": "identity", "bytes": len(body), "encode_ms": encode_seconds * 1000, "compress_ms": 0.0}]
+    for encoding in compression.encodings():
+        compressed, seconds = cpu_seconds(functools.partial(compression.compress, body, encoding, settings), repeat)
+        results.append({"encoding": encoding, "bytes": len(compressed),
+                        "encode_ms": encode_seconds * 1000, "compress_ms": seconds * 1000})
+    return results
+
+
+def run(sizes: list, repeat: int, seed: int) -> list:
+    """Encodes each size of list in every format and content coding and returns their cost"""
+    # pylint: disable=import-outside-toplevel
+    from service import config
+    from service.common import encoder
+    from service.routes import promotion_model
+
+    settings = {name: getattr(config, name) for name in ("COMPRESS_GZIP_LEVEL", "COMPRESS_BROTLI_QUALITY")}
+    columns = list(promotion_model.resolved)
+    formats = {"json": encoder.RowEncoder.encode}
+    if encoder.msgpack is not None:
+        formats["msgpack"] = encoder.RowEncoder.pack
+    results = []
+    for size in sizes:
+        rows = build_rows(size, columns, seed)
+        row_encoder = encoder.RowEncoder(promotion_model, columns)
+        for name, encode in formats.items():
+            results.extend({"format": name, "size": size, **result}
+                           for result in measure(row_encoder, rows, encode, settings, repeat))
+    return results
+
+
+def main():
+    """Parses the command line and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma separated numbers of Promotions")
+    parser.add_argument("--repeat", type=int, default=3, help="times each list is encoded and compressed")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    results = run([int(size) for size in args.sizes.split(",")], args.repeat, args.seed)
+    if args.json:
+        print(json.dumps(results))
+        return
+    plain = {result["size"]: result["bytes"]
+             for result in results if (result["format"], result["encoding"]) == ("json", "identity")}
+    print(f"Python {platform.python_version()}")
+    print(f"  {'format':<9}{'encoding':<10}{'size':>8}{'bytes':>13}{'of json':>9}{'encode ms':>11}{'compress ms':>13}")
+    for result in results:
+        print(f"  {result['format']:<9}{result['encoding']:<10}{result['size']:>8}{result['bytes']:>13,}"
+              f"{result['bytes'] / plain[result['size']]:>9.0%}{result['encode_ms']:>11.1f}"
+              f"{result['compress_ms']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+List serialization benchmark
+
+Compares the ways the list of Promotions has been turned into JSON:
+loading ORM objects and marshalling their serialize() output, selecting
+row tuples and marshalling serialize_row() output, and encoding the row
+tuples straight to JSON with RowEncoder, with and without orjson.
+
+The benchmark empties the promotion table of the database it runs
+against, so point it at SQLite or a scratch Postgres database.
+
+Usage:
+    python -m benchmarks.serialize --sizes 1000,10000
+"""
+import argparse
+import json
+import os
+import time
+from unittest.mock import patch
+from benchmarks.api import Suite, add_database_argument
+
+
+def paths(promotion_class, db, model):
+    """Returns the functions that query and encode every Promotion by each path"""
+    # the service reads DATABASE_URI when it is imported
+    # pylint: disable=import-outside-toplevel
+    from flask_restx import marshal
+    from service.common import encoder
+
+    def orm_marshal():
+        promotions = promotion_class.query.order_by(promotion_class.id).all()
+        data = json.dumps(marshal([promotion.serialize() for promotion in promotions], model))
+        db.session.expunge_all()  # do not let the identity map carry over
+        return data
+
+    def rows_marshal():
+        rows = promotion_class.select_page().all()
+        return json.dumps(marshal([promotion_class.serialize_row(row) for row in rows], model))
+
+    def rows_encoder():
+        query = promotion_class.select_page()
+        columns = [column["name"] for column in query.column_descriptions]
+        return encoder.RowEncoder(model, columns).encode(query.all())
+
+    def rows_encoder_json():
+        with patch.object(encoder, "orjson", None):
+            return rows_encoder()
+
+    found = {"orm_marshal": orm_marshal, "rows_marshal": rows_marshal, "rows_encoder": rows_encoder}
+    if encoder.orjson is not None:
+        found["rows_encoder_json"] = rows_encoder_json
+    return found
+
+
+def run(sizes: list, repeat: int, seed: int) -> list:
+    """Seeds each size of table and returns the Promotions encoded per second by each path"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion, db
+    from service.routes import promotion_model
+
+    suite = Suite(0, seed)
+    results = []
+    for size in sizes:
+        suite.seed(size)
+        for name, function in paths(Promotion, db, promotion_model).items():
+            function()  # warm up
+            start = time.perf_counter()
+            for _ in range(repeat):
+                function()
+            seconds = (time.perf_counter() - start) / repeat
+            results.append({"path": name, "size": size, "seconds": seconds, "rows_per_second": size / seconds})
+    return results
+
+
+def main():
+    """Parses the command line and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_argument(parser)
+    parser.add_argument("--sizes", default="1000,10000", help="comma separated numbers of Promotions to seed")
+    parser.add_argument("--repeat", type=int, default=5, help="times each path encodes the table")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    os.environ["DATABASE_URI"] = args.database_uri
+    results = run([int(size) for size in args.sizes.split(",")], args.repeat, args.seed)
+    if args.json:
+        print(json.dumps(results))
+        return
+    baseline = {result["size"]: result["rows_per_second"]
+                for result in results if result["path"] == "orm_marshal"}
+    for result in results:
+        print(f"  {result['path']:<20}{result['size']:>8}{result['rows_per_second']:>14,.0f} rows/s"
+              f"{result['rows_per_second'] / baseline[result['size']]:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
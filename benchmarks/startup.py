@@ -0,0 +1,166 @@
+"""
+Cold start benchmark
+
+Starts a fresh interpreter again and again and times each step a worker
+takes before it can serve: importing the models, creating the app with
+create_app(), answering the first request that needs no database and the
+first one that queries it. The wall time of the whole process includes the
+interpreter start up. The medians can be saved as JSON and compared against
+a stored baseline, failing when a step got slower than the tolerance.
+
+The benchmark creates the promotion table in the database it runs against
+if it is missing and reads one row from it.
+
+Usage:
+    python -m benchmarks.startup --repeat 20 --save startup.json
+    python -m benchmarks.startup --baseline startup.json --tolerance 0.25
+    python -m benchmarks.startup --imports 15
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from benchmarks.api import add_database_argument, finish, percentile
+
+STEPS = ["import_models", "create_app", "first_request", "first_query", "process"]
+
+
+def child():
+    """Times the start up steps in this interpreter and prints them as JSON"""
+    # pylint: disable=import-outside-toplevel
+    times = {}
+    began = time.perf_counter()
+    import service.models  # noqa: F401  pylint: disable=unused-import
+    times["import_models"] = time.perf_counter() - began
+
+    began = time.perf_counter()
+    from service import create_app
+    app = create_app()
+    app.logger.setLevel("CRITICAL")
+    times["create_app"] = time.perf_counter() - began
+
+    client = app.test_client()
+    for step, url in [("first_request", "/health"), ("first_query", "/api/promotions?limit=1")]:
+        began = time.perf_counter()
+        response = client.get(url)
+        times[step] = time.perf_counter() - began
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+    print(json.dumps(times))
+
+
+def start_once(env: dict) -> dict:
+    """Runs one cold start in a new interpreter and returns the time of each step"""
+    began = time.perf_counter()
+    output = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child"], env=env,
+                            check=True, capture_output=True, text=True).stdout
+    times = json.loads(output.splitlines()[-1])
+    times["process"] = time.perf_counter() - began
+    return times
+
+
+def slowest_imports(env: dict, count: int) -> list:
+    """Returns the packages that take the longest to import with the service, from -X importtime"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "from service import app"],
+                            env=env, check=True, capture_output=True, text=True).stderr
+    packages = {}
+    for line in stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        package = name.split(".")[0]
+        if package == "service" and name != "service":
+            package = name  # the modules of the service are reported one by one
+        packages[package] = packages.get(package, 0) + int(fields[0].split(":")[1])
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return [{"module": name, "ms": micros / 1000} for name, micros in ranked[:count]]
+
+
+def create_schema(database_uri: str):
+    """Creates the promotion table the first query reads, if it is missing"""
+    # pylint: disable=import-outside-toplevel
+    os.environ["DATABASE_URI"] = database_uri
+    from service import create_app
+    from service.models import create_schema as create_tables
+    create_app().logger.setLevel("CRITICAL")
+    create_tables()
+
+
+def run(args) -> list:
+    """Starts the service repeat times and returns the median and p95 of each step"""
+    env = {**os.environ, "DATABASE_URI": args.database_uri}
+    start_once(env)  # warm up the file system cache
+    runs = [start_once(env) for _ in range(args.repeat)]
+    return [{
+        "step": step,
+        "median_ms": statistics.median(run[step] for run in runs) * 1000,
+        "p95_ms": percentile([run[step] for run in runs], 95) * 1000,
+    } for step in STEPS]
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """Returns the steps whose median grew more than the tolerance above the baseline"""
+    previous = {result["step"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["step"])
+        if before is None:
+            continue
+        result["change"] = result["median_ms"] / before["median_ms"] - 1
+        if result["change"] > tolerance:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    """Parses the command line, runs the cold starts and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_argument(parser)
+    parser.add_argument("--repeat", type=int, default=10, help="number of cold starts")
+    parser.add_argument("--imports", type=int, default=0, help="also list the N slowest imports")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--save", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare the results with the JSON saved by --save")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="fraction a step may get slower than the baseline before failing")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    create_schema(args.database_uri)
+    results = run(args)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file)["results"], args.tolerance)
+    report = {"python": platform.python_version(), "repeat": args.repeat, "results": results}
+    if args.imports:
+        report["imports"] = slowest_imports({**os.environ, "DATABASE_URI": args.database_uri}, args.imports)
+    finish(args, report, regressions, print_report)
+
+
+def print_report(report: dict, regressions: list):
+    """Prints the results as a table"""
+    print(f"{report['repeat']} cold starts on Python {report['python']}")
+    print(f"  {'step':<15}{'median ms':>11}{'p95 ms':>9}{'change':>9}")
+    for result in report["results"]:
+        change = f"{result['change']:+.0%}" if "change" in result else ""
+        print(f"  {result['step']:<15}{result['median_ms']:>11.1f}{result['p95_ms']:>9.1f}{change:>9}")
+    if "imports" in report:
+        print("  slowest imports")
+        for entry in report["imports"]:
+            print(f"    {entry['module']:<28}{entry['ms']:>9.1f} ms")
+    for result in regressions:
+        print(f"REGRESSION: {result['step']} is {result['change']:.0%} slower than the baseline")
+
+
+if __name__ == "__main__":
+    main()
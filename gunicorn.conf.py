@@ -0,0 +1,35 @@
+"""
+gunicorn settings
+
+gunicorn loads this file from the working folder. It gives every worker a
+shared folder for its Prometheus samples so /metrics reports all of the
+workers, and removes the samples of the workers that exit.
+
+Each worker serves its requests on a pool of threads, so a request that
+waits, like a long-poll of the change feed, holds one thread while the
+others keep serving and the writes that would wake it can still run.
+"""
+import os
+import shutil
+import tempfile
+
+# The folder must exist and be empty before the workers import the service
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "promotions-metrics"))
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:" + os.getenv("PORT", "8080"))
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Clears the samples left behind by the last run"""
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the live gauges of a worker that exited"""
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+    multiprocess.mark_process_dead(worker.pid)
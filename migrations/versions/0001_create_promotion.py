@@ -0,0 +1,40 @@
+"""create promotion table
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+promotion_type = sa.Enum('ABS_DISCOUNT', 'PERCENT_DISCOUNT', 'UNKNOWN', name='promotiontype')
+
+
+def upgrade():
+    op.create_table(
+        'promotion',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=63), nullable=False),
+        sa.Column('type', promotion_type, server_default='ABS_DISCOUNT', nullable=False),
+        sa.Column('description', sa.String(length=63), nullable=False),
+        sa.Column('promotion_value', sa.Integer(), nullable=True),
+        sa.Column('promotion_percent', sa.Float(), nullable=True),
+        sa.Column('status', sa.Boolean(), nullable=False),
+        sa.Column('expiry', sa.Date(), nullable=False),
+        sa.Column('created_at', sa.Date(), nullable=False),
+        sa.Column('last_updated_at', sa.Date(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('promotion')
+    promotion_type.drop(op.get_bind(), checkfirst=True)
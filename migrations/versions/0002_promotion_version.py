@@ -0,0 +1,36 @@
+"""add promotion version and update timestamp
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('promotion') as batch_op:
+        batch_op.add_column(
+            sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+        batch_op.alter_column(
+            'last_updated_at', type_=sa.DateTime(timezone=True),
+            existing_type=sa.Date(), existing_nullable=False)
+    with op.batch_alter_table('promotion') as batch_op:
+        # the model sets the version itself from now on
+        batch_op.alter_column('version', server_default=None, existing_type=sa.Integer())
+
+
+def downgrade():
+    with op.batch_alter_table('promotion') as batch_op:
+        batch_op.alter_column(
+            'last_updated_at', type_=sa.Date(),
+            existing_type=sa.DateTime(timezone=True), existing_nullable=False)
+        batch_op.drop_column('version')
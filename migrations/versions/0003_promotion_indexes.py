@@ -0,0 +1,30 @@
+"""add promotion indexes for the status, expiry and type filters
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_promotion_active_id', 'promotion', ['id'],
+        postgresql_where=sa.text('status'), sqlite_where=sa.text('status'))
+    op.create_index('ix_promotion_status_expiry', 'promotion', ['status', 'expiry'])
+    op.create_index('ix_promotion_type', 'promotion', ['type'])
+
+
+def downgrade():
+    op.drop_index('ix_promotion_type', table_name='promotion')
+    op.drop_index('ix_promotion_status_expiry', table_name='promotion')
+    op.drop_index('ix_promotion_active_id', table_name='promotion')
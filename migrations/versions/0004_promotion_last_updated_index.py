@@ -0,0 +1,23 @@
+"""add promotion index for the rows updated since a time
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 14:05:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_promotion_last_updated_at', 'promotion', ['last_updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_promotion_last_updated_at', table_name='promotion')
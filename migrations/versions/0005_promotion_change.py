@@ -0,0 +1,36 @@
+"""add the promotion change log
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 16:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'promotion_change',
+        sa.Column('seq', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('promotion_id', sa.Integer(), nullable=True),
+        sa.Column('operation', sa.String(length=8), nullable=False),
+        sa.Column('changed_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('seq')
+    )
+    # the existing Promotions start the log so a feed read from 0 has all of them
+    op.execute(
+        "INSERT INTO promotion_change (promotion_id, operation, changed_at) "
+        "SELECT id, 'create', last_updated_at FROM promotion ORDER BY id"
+    )
+
+
+def downgrade():
+    op.drop_table('promotion_change')
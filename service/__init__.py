@@ -1,24 +1,19 @@
 """
 Package: service
 Package for the application models and service routes
-This module creates and configures the Flask app and sets up the logging
-and SQL database
+This module creates and configures the Flask app with create_app() and sets
+up the logging and SQL database. Importing the package builds nothing: the
+app is created on first use of service.app and connects to the database on
+its first query. The schema is created by "flask db upgrade" (or
+"flask db-create" on a local database), never when the app starts.
 """
-import sys
 from flask import Flask
 from flask_restx import Api
-from service import config
-from service.common import log_handlers
-
-# Create Flask application
-app = Flask(__name__)
-app.config.from_object(config)
 
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
-api = Api(app,
-          version='1.0.0',
+api = Api(version='1.0.0',
           title='Promotion REST API Service',
           description='This is a sample Promotion server.',
           default='promotions',
@@ -27,23 +22,63 @@ api = Api(app,
           prefix='/api'
           )
 
-# Dependencies require we import the routes AFTER the Flask app is created
-# pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
-from service import routes, models        # noqa: F401, E402
-from service.common import error_handlers, cli_commands  # noqa: F401, E402
+# The default app, created by __getattr__() the first time it is used
+app: Flask
+
+
+def create_app(settings: dict = None) -> Flask:
+    """
+    Creates and configures the Flask app without touching the database
+
+    Args:
+        settings (dict): configuration that overrides service.config
+
+    Returns:
+        Flask: the app with the routes, the database and the background workers
+    """
+    # Dependencies require we import the routes AFTER the Api is created
+    # pylint: disable=import-outside-toplevel, cyclic-import, unused-import, redefined-outer-name
+    from service import config, routes, models
+    from service.changes import feed
+    from service.common import error_handlers, cli_commands, compression, log_handlers, metrics  # noqa: F401
+    from service.idempotency import idempotency
+    from service.snapshot import snapshot
+    from service.stats import stats
+    from service.sweeper import sweeper
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config.update(settings or {})
+
+    # Set up logging for production
+    log_handlers.init_logging(app, "gunicorn.error")
+
+    # Instrument the requests and the database before the first connection
+    metrics.init_app(app)
+    # Registered after the metrics so they record the compressed sizes
+    compression.init_app(app)
+
+    app.logger.info(70 * "*")
+    app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
+    api.init_app(app)
+    app.register_blueprint(routes.blueprint)
+    cli_commands.init_app(app)
+    models.init_db(app)  # binds SQLAlchemy, connects on the first query
+    snapshot.init_app(app)
+    stats.init_app(app)
+    feed.init_app(app)
+    idempotency.init_app(app)
+    sweeper.init_app(app)
 
-app.logger.info(70 * "*")
-app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+    app.logger.info("Service initialized!")
+    return app
 
-try:
-    models.init_db(app)  # make our SQLAlchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
 
-app.logger.info("Service initialized!")
+def __getattr__(name: str):
+    """Creates the default app the first time service.app is used"""
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
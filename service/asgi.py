@@ -0,0 +1,383 @@
+"""
+ASGI Service
+
+Serves the /api/promotions contract with async handlers on Starlette and
+the asyncpg driver, so a worker keeps many requests waiting on Postgres
+at once instead of one per sync worker. Run it with:
+
+    uvicorn service.asgi:app
+    gunicorn -k uvicorn.workers.UvicornWorker service.asgi:app
+
+It shares the configuration, the schema and the validation of the Flask
+service: bodies go through Promotion.deserialize() and the list filters,
+sort order and cursors through PromotionQuery. Writes append to the change
+log and notify the snapshot of active Promotions of every worker the same
+way the commits of the Flask service do.
+"""
+import json
+from datetime import date
+from flask_restx import inputs
+from sqlalchemy import select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.endpoints import HTTPEndpoint
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+from service import app as flask_app
+from service.changes import APPEND_CHANGES, CREATE, DELETE, UPDATE, append_parameters
+from service.common import status
+from service.common.encoder import RowEncoder, dumps
+from service.common.constraints import integrity_response, is_data_error
+from service.common.etags import list_etag, page_fingerprint
+from service.models import PROMOTION_FIELDS, Promotion, PromotionQuery, PromotionType, DataValidationError, utcnow
+from service.routes import VERSION_COLUMNS, list_filters, promotion_model
+from service.snapshot import CHANNEL
+
+config = flask_app.config
+logger = flask_app.logger
+
+TABLE = Promotion.__table__
+
+# Encodes whole rows of the promotion table as the JSON of the Flask service
+ROW_ENCODER = RowEncoder(promotion_model, [column.name for column in TABLE.c])
+
+
+def engine_options() -> dict:
+    """Returns the options of the async engine, the pool of the Flask service for asyncpg"""
+    options = {name: value for name, value in config["SQLALCHEMY_ENGINE_OPTIONS"].items()
+               if name != "connect_args"}
+    options["connect_args"] = {
+        "timeout": config["DB_CONNECT_TIMEOUT"],
+        "server_settings": {"statement_timeout": str(config["DB_STATEMENT_TIMEOUT"])},
+    }
+    return options
+
+
+def database_url():
+    """Returns the database URL of the Flask service with the asyncpg driver"""
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() != "postgresql":
+        raise RuntimeError("The async service needs a Postgres database")
+    return url.set(drivername="postgresql+asyncpg")
+
+
+async def startup():
+    """Connects the async engine"""
+    app.state.engine = create_async_engine(database_url(), **engine_options())
+    logger.info("Async service connected to %s", app.state.engine.url.render_as_string())
+
+
+async def shutdown():
+    """Closes the connections of the async engine"""
+    await app.state.engine.dispose()
+
+
+######################################################################
+#  PATH: /api/promotions/{id}
+######################################################################
+class PromotionResource(HTTPEndpoint):
+    """
+    Allows the manipulation of a single Promotion
+    GET /promotion{id} - Returns a Promotion with the id
+    PUT /promotion{id} - Update a Promotion with the id
+    DELETE /promotion{id} -  Deletes a Promotion with the id
+    """
+
+    async def get(self, request):
+        """Retrieve a single Promotion"""
+        promotion_id = request.path_params["promotion_id"]
+        async with request.app.state.engine.connect() as connection:
+            row = (await connection.execute(
+                TABLE.select().where(TABLE.c.id == promotion_id))).first()
+        if row is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND,
+                                f"Promotion with id '{promotion_id}' was not found.")
+        headers = version_headers(row)
+        if is_not_modified(request, f"{row.id}-{row.version}", row.last_updated_at):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return promotion_response(row, status.HTTP_200_OK, headers)
+
+    async def put(self, request):
+        """Update a Promotion"""
+        promotion_id = request.path_params["promotion_id"]
+        data = await read_json(request)
+        async with request.app.state.engine.begin() as connection:
+            version = (await connection.execute(
+                select(TABLE.c.version).where(TABLE.c.id == promotion_id))).scalar()
+            if version is None:
+                raise HTTPException(status.HTTP_404_NOT_FOUND,
+                                    f"Promotion with id '{promotion_id}' was not found.")
+            if_match = parse_etags(request.headers.get("if-match"))
+            if if_match and not if_match.contains(f"{promotion_id}-{version}"):
+                raise HTTPException(status.HTTP_412_PRECONDITION_FAILED,
+                                    f"Promotion with id '{promotion_id}' has been changed.")
+            promotion = Promotion().deserialize(data)
+            row = (await connection.execute(
+                TABLE.update()
+                .where(TABLE.c.id == promotion_id, TABLE.c.version == version)
+                .values(**written_columns(promotion), version=version + 1, last_updated_at=utcnow())
+                .returning(*TABLE.c))).first()
+            if row is None:
+                raise HTTPException(
+                    status.HTTP_409_CONFLICT,
+                    "The Promotion was changed by another request, read it again and retry")
+            await notify(connection, promotion_id, UPDATE)
+        await forget(promotion_id)
+        return promotion_response(row, status.HTTP_200_OK, version_headers(row))
+
+    async def delete(self, request):
+        """Delete a Promotion"""
+        promotion_id = request.path_params["promotion_id"]
+        async with request.app.state.engine.begin() as connection:
+            deleted = (await connection.execute(
+                TABLE.delete().where(TABLE.c.id == promotion_id).returning(TABLE.c.id))).first()
+            if deleted is not None:
+                await notify(connection, promotion_id, DELETE)
+        if deleted is not None:
+            await forget(promotion_id)
+            logger.info("Promotion with ID [%s] delete complete.", promotion_id)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+#  PATH: /api/promotions
+######################################################################
+class PromotionCollection(HTTPEndpoint):
+    """Handles all interactions with collections of Promotions"""
+
+    async def get(self, request):
+        """Returns a list of all of the Promotions"""
+        args = list_arguments(request.query_params)
+        search = PromotionQuery(**list_filters(args))
+        field_names = None
+        if args["fields"]:
+            field_names = [name.strip() for name in args["fields"].split(",")]
+        statement = search.after(search.statement(field_names), args["cursor"])
+        limit = args["limit"]
+        if limit:
+            # one extra row to find out if there is a next page
+            statement = statement.limit(limit + 1).add_columns(*VERSION_COLUMNS)
+
+        async with request.app.state.engine.connect() as connection:
+            # the fingerprint changes whenever a Promotion in the list does,
+            # a page is summarized from its own rows like the Flask service does
+            if limit:
+                result = await connection.execute(statement)
+                rows = result.all()
+                fingerprint = page_fingerprint(rows)
+            else:
+                fingerprint = tuple((await connection.execute(search.summary())).one())
+            etag = list_etag(request.query_params.multi_items(), fingerprint)
+            headers = {"ETag": quote_etag(etag)}
+            if fingerprint[3] is not None:
+                headers["Last-Modified"] = http_date(fingerprint[3])
+            if parse_etags(request.headers.get("if-none-match")).contains_weak(etag):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+            if not limit:
+                result = await connection.execute(statement)
+                rows = result.all()
+
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = search.cursor(Promotion.serialize_row(rows[-1]))
+            headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+            headers["X-Next-Cursor"] = next_cursor
+        encoder = RowEncoder(promotion_model, list(result.keys()), mask=field_names)
+        return Response(encoder.encode(rows), media_type="application/json", headers=headers)
+
+    async def post(self, request):
+        """Creates a Promotion"""
+        promotion = Promotion().deserialize(await read_json(request))
+        async with request.app.state.engine.begin() as connection:
+            row = (await connection.execute(
+                TABLE.insert()
+                .values(**written_columns(promotion), created_at=date.today(),
+                        last_updated_at=utcnow(), version=1)
+                .returning(*TABLE.c))).first()
+            await notify(connection, row.id, CREATE)
+        logger.info("Promotion with new id [%s] created!", row.id)
+        headers = {"Location": str(request.url_for("promotion", promotion_id=row.id)), **version_headers(row)}
+        return promotion_response(row, status.HTTP_201_CREATED, headers)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+
+async def health(_request):
+    """Let them know our heart is still beating"""
+    return JSONResponse({"status": 200, "message": "Healthy"})
+
+
+def list_arguments(params) -> dict:
+    """Parses the list arguments with the rules of the Flask service"""
+    parsers = {
+        "status": inputs.boolean,
+        "type": promotion_type_name,
+        "expires_before": inputs.date_from_iso8601,
+        "expires_after": inputs.date_from_iso8601,
+        "min_value": int,
+        "max_value": int,
+        "name": str,
+        "sort": str,
+        "limit": inputs.int_range(1, config["MAX_PAGE_SIZE"]),
+        "cursor": str,
+        "fields": str,
+    }
+    args = {}
+    for name, parse in parsers.items():
+        value = params.get(name)
+        try:
+            args[name] = None if value is None else parse(value)
+        except ValueError as error:
+            raise DataValidationError(f"Invalid {name}: {value}") from error
+    return args
+
+
+def promotion_type_name(value: str) -> str:
+    """Checks that a string is the name of a PromotionType"""
+    if value not in PromotionType.__members__:
+        raise ValueError(value)
+    return value
+
+
+async def read_json(request):
+    """Returns the JSON body of a request"""
+    try:
+        return await request.json()
+    except ValueError as error:
+        raise DataValidationError(f"Invalid JSON body: {error}") from error
+
+
+def written_columns(promotion) -> dict:
+    """Returns the columns a deserialized Promotion sets, converted to the types of the columns"""
+    return {
+        name: column_value(TABLE.c[name].type.python_type, getattr(promotion, name))
+        for name in PROMOTION_FIELDS if name != "id"
+    }
+
+
+def column_value(python_type: type, value):
+    """Converts a JSON value the way Postgres casts the text psycopg2 sends for it
+
+    asyncpg sends typed parameters and rejects "10" for an integer column,
+    which the Flask service stores as 10. A value that does not convert is
+    left for the database to reject like it does for the Flask service.
+    """
+    if python_type is str and isinstance(value, (bool, int, float)):
+        return json.dumps(value)  # true, 10 and 1.5 as Postgres writes them
+    if python_type in (int, float) and isinstance(value, bool):
+        raise DataValidationError(f"Invalid type for number: {value}")  # asyncpg would store 1
+    if python_type in (int, float) and isinstance(value, str):
+        try:
+            return python_type(value)
+        except ValueError:
+            return value
+    return value
+
+
+def promotion_response(row, status_code, headers) -> Response:
+    """Returns a response with the marshalled JSON of a row"""
+    return Response(dumps(ROW_ENCODER.to_dict(row)), status_code=status_code,
+                    media_type="application/json", headers=headers)
+
+
+def version_headers(row) -> dict:
+    """Returns the ETag and Last-Modified headers of a row"""
+    return {"ETag": quote_etag(f"{row.id}-{row.version}"), "Last-Modified": http_date(row.last_updated_at)}
+
+
+def is_not_modified(request, etag: str, last_modified) -> bool:
+    """Checks the conditional GET headers against the current version of a resource"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+    if_modified_since = parse_date(request.headers.get("if-modified-since"))
+    if if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+async def notify(connection, promotion_id, operation):
+    """Logs a change and sends its id to the snapshots of the workers when the transaction commits"""
+    await connection.execute(APPEND_CHANGES, append_parameters([(promotion_id, operation)]))
+    if config["SNAPSHOT_LISTEN"]:
+        await connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                 {"channel": CHANNEL, "payload": str(promotion_id)})
+
+
+async def forget(promotion_id):
+    """Removes a changed Promotion from the cache the Flask service reads by id"""
+    await run_in_threadpool(Promotion.cache.delete, str(promotion_id))
+
+
+######################################################################
+#  E R R O R   H A N D L E R S
+######################################################################
+
+def error_response(status_code: int, error: str, message: str) -> JSONResponse:
+    """Returns the JSON error body of the Flask service"""
+    return JSONResponse({"status_code": status_code, "error": error, "message": message},
+                        status_code=status_code)
+
+
+async def request_validation_error(_request, error):
+    """Handles Value Errors from bad data"""
+    logger.error(str(error))
+    return error_response(status.HTTP_400_BAD_REQUEST, "Bad Request", str(error))
+
+
+async def http_error(_request, error):
+    """Handles the HTTP errors raised by the endpoints"""
+    names = {
+        status.HTTP_404_NOT_FOUND: "Not Found",
+        status.HTTP_405_METHOD_NOT_ALLOWED: "Method not Allowed",
+        status.HTTP_409_CONFLICT: "Conflict",
+        status.HTTP_412_PRECONDITION_FAILED: "Precondition Failed",
+    }
+    return error_response(error.status_code, names.get(error.status_code, "Error"), error.detail)
+
+
+async def database_unavailable_error(_request, error):
+    """Handles failed connections, cancelled statements and an exhausted connection pool"""
+    message = f"Database unavailable: {type(error).__name__}: {getattr(error, 'orig', None) or error}"
+    logger.critical(message)
+    return error_response(status.HTTP_503_SERVICE_UNAVAILABLE, "Service Unavailable", message)
+
+
+async def integrity_error(_request, error):
+    """Handles writes rejected by a constraint such as the unique Promotion names"""
+    status_code, name, message = integrity_response(error)
+    logger.warning("%s: %s", message, getattr(error, 'orig', None) or error)
+    return error_response(status_code, name, message)
+
+
+async def data_error(request, error):
+    """Handles writes with a value that does not fit its column, the other database errors are server errors"""
+    if not is_data_error(error):
+        raise error
+    return await integrity_error(request, error)
+
+
+app = Starlette(
+    routes=[
+        Route("/health", health),
+        Route("/api/promotions", PromotionCollection),
+        Route("/api/promotions/{promotion_id:int}", PromotionResource, name="promotion"),
+    ],
+    exception_handlers={
+        DataValidationError: request_validation_error,
+        HTTPException: http_error,
+        IntegrityError: integrity_error,
+        DBAPIError: data_error,
+        OperationalError: database_unavailable_error,
+        PoolTimeoutError: database_unavailable_error,
+    },
+    on_startup=[startup],
+    on_shutdown=[shutdown],
+)
@@ -0,0 +1,228 @@
+"""
+Promotion Change Feed
+
+Appends a row to the promotion_change table for every Promotion that a
+transaction creates, updates or deletes, as part of that transaction, so
+the log holds the committed writes and nothing else. Downstream caches
+read it with GET /api/promotions/changes?since=<seq> and sync in
+O(changes) instead of downloading the whole catalog again.
+
+The rows are numbered in commit order. On Postgres every transaction that
+appends takes an advisory lock first and holds it until it commits, so a
+reader that has seen change N never finds a smaller number committed
+later. The lock is only held for the last statement of the transaction.
+
+A read that finds no changes can wait up to CHANGES_MAX_WAIT seconds for
+the next one. The commits of this worker wake it at once and the commits
+of the other workers are picked up every CHANGES_POLL_SECONDS.
+"""
+import logging
+import threading
+import time
+from sqlalchemy import event, text
+from sqlalchemy import insert as insert_rows
+from sqlalchemy import select as select_rows
+from sqlalchemy.orm import Session, object_session
+from service.models import CHANGE_KEYS, PROMOTION_FIELDS, Promotion, db, on_change, pending_changes, utcnow
+
+logger = logging.getLogger("flask.app")
+
+CREATE = "create"
+UPDATE = "update"
+DELETE = "delete"
+# Recorded when a bulk query changed Promotions it cannot name, the
+# consumers have to download the catalog again
+RESYNC = "resync"
+
+# The change recorded for a Promotion written more than once in a transaction
+PRECEDENCE = {UPDATE: 0, CREATE: 1, DELETE: 2}
+
+# The advisory lock the appending transactions take in turn
+LOCK_KEY = 0x70726F6D
+
+# The operations are saved and restored with the changed ids at savepoints
+CHANGE_KEYS.append("promotion_operations")
+
+
+class PromotionChange(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Class that represents one committed change of a Promotion
+    """
+
+    __tablename__ = "promotion_change"
+
+    # SQLite only numbers the rows itself for an INTEGER primary key
+    seq = db.Column(db.BigInteger().with_variant(db.Integer(), "sqlite"), primary_key=True)
+    promotion_id = db.Column(db.Integer)  # None for a resync
+    operation = db.Column(db.String(8), nullable=False)
+    changed_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f"<PromotionChange {self.seq} {self.operation} id=[{self.promotion_id}]>"
+
+
+class ChangeFeed:
+    """Reads the change log and wakes the readers waiting for a change"""
+
+    def __init__(self, max_wait=30.0, poll_seconds=1.0):
+        """
+        Args:
+            max_wait (float): the longest a read waits for a change
+            poll_seconds (float): how often a waiting read looks for the
+                changes committed by the other workers
+        """
+        self.max_wait = max_wait
+        self.poll_seconds = poll_seconds
+        self._changed = threading.Condition()
+        self._commits = 0  # commits of this worker seen so far
+
+    def init_app(self, app):
+        """Configures the feed from the Flask app and wakes the readers on every write"""
+        self.max_wait = app.config["CHANGES_MAX_WAIT"]
+        self.poll_seconds = app.config["CHANGES_POLL_SECONDS"]
+        on_change(self.changed)
+
+    def changed(self, ids):  # pylint: disable=unused-argument
+        """Change listener that wakes the reads waiting for a change"""
+        with self._changed:
+            self._commits += 1
+            self._changed.notify_all()
+
+    def read(self, since=0, limit=100, wait=0.0) -> list:
+        """
+        Returns the changes after a number, oldest first
+
+        Args:
+            since (int): the number of the last change seen, 0 for all of them
+            limit (int): the most changes to return
+            wait (float): how long to wait for a change when there are none,
+                at most max_wait seconds
+
+        Returns:
+            list: a dictionary for each change with its number, the id of the
+                Promotion, the operation, when it was committed and the
+                Promotion as serialize() returns it, None once it is deleted
+        """
+        deadline = time.monotonic() + min(wait, self.max_wait)
+        while True:
+            with self._changed:
+                commits = self._commits
+            changes = self._select(since, limit)
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+            with self._changed:
+                if self._commits == commits:
+                    self._changed.wait(min(remaining, self.poll_seconds))
+
+    @staticmethod
+    def _select(since, limit) -> list:
+        """Returns the changes after a number with the current columns of their Promotions"""
+        table = PromotionChange.__table__
+        promotion = Promotion.__table__
+        statement = (
+            select_rows(table.c.seq, table.c.promotion_id, table.c.operation, table.c.changed_at,
+                        *[promotion.c[name] for name in PROMOTION_FIELDS])
+            .outerjoin(promotion, promotion.c.id == table.c.promotion_id)
+            .where(table.c.seq > since)
+            .order_by(table.c.seq)
+            .limit(limit)
+        )
+        # a connection of its own, returned to the pool before any wait
+        with db.engine.connect() as connection:
+            return [_entry(row) for row in connection.execute(statement)]
+
+
+def _entry(row) -> dict:
+    """Returns a change with the current Promotion serialized like serialize() does"""
+    promotion = None
+    if row.id is not None:
+        promotion = Promotion.serialize_row(row)
+        for name in ("seq", "promotion_id", "operation", "changed_at"):
+            del promotion[name]
+    return {
+        "seq": row.seq,
+        "id": row.promotion_id,
+        "operation": row.operation,
+        "changed_at": row.changed_at,
+        "promotion": promotion,
+    }
+
+
+######################################################################
+#  C H A N G E   L O G
+######################################################################
+# The operation of each Promotion the ORM writes is collected on the
+# session and the log is appended just before the transaction commits
+
+# Appends changes on Postgres in one round trip that takes the lock first
+APPEND_CHANGES = text(
+    "WITH appending AS (SELECT pg_advisory_xact_lock(:key)) "
+    "INSERT INTO promotion_change (promotion_id, operation, changed_at) "
+    "SELECT change.promotion_id, change.operation, clock_timestamp() "
+    "FROM appending, unnest(CAST(:ids AS integer[]), CAST(:operations AS text[])) "
+    "AS change (promotion_id, operation)"
+)
+
+
+def append_parameters(changes) -> dict:
+    """Returns the parameters of APPEND_CHANGES for a list of (id, operation) pairs"""
+    return {
+        "key": LOCK_KEY,
+        "ids": [id_ for id_, _ in changes],
+        "operations": [operation for _, operation in changes],
+    }
+
+
+def _record(target, operation):
+    """Records the strongest operation a transaction applied to a Promotion"""
+    session = object_session(target)
+    if session is None:
+        return
+    operations = session.info.setdefault("promotion_operations", {})
+    if PRECEDENCE[operation] >= PRECEDENCE.get(operations.get(target.id), -1):
+        operations[target.id] = operation
+
+
+@event.listens_for(Promotion, "after_insert")
+def _record_create(mapper, connection, target):  # pylint: disable=unused-argument
+    _record(target, CREATE)
+
+
+@event.listens_for(Promotion, "after_update")
+def _record_update(mapper, connection, target):  # pylint: disable=unused-argument
+    _record(target, UPDATE)
+
+
+@event.listens_for(Promotion, "after_delete")
+def _record_delete(mapper, connection, target):  # pylint: disable=unused-argument
+    _record(target, DELETE)
+
+
+@event.listens_for(Session, "before_commit")
+def _append_changes(session):
+    """Appends the changes of a transaction to the log as part of it"""
+    if session.in_nested_transaction():
+        return
+    session.flush()  # record the last writes too
+    ids = pending_changes(session)
+    # the Core updates of set_status() and deactivate_expired() name their ids only
+    operations = session.info.pop("promotion_operations", {})
+    if ids == set():
+        return
+    if ids is None:
+        rows = [(None, RESYNC)]
+    else:
+        rows = [(id_, operations.get(id_, UPDATE)) for id_ in sorted(ids)]
+    connection = session.connection()
+    if connection.dialect.name == "postgresql":
+        connection.execute(APPEND_CHANGES, append_parameters(rows))
+        return
+    now = utcnow()
+    connection.execute(insert_rows(PromotionChange.__table__), [
+        {"promotion_id": id_, "operation": operation, "changed_at": now} for id_, operation in rows
+    ])
+
+
+# The change feed read by the service
+feed = ChangeFeed()
@@ -0,0 +1,214 @@
+"""
+Cache Backends
+
+This module contains the caches used to keep hot data out of the database.
+LRUCache lives in the worker process. SharedCache keeps the entries in a
+server shared by all of the workers, such as Redis, or in FakeCacheServer
+which stands in for one when running locally.
+"""
+import fnmatch
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A least recently used cache whose entries expire after a time to live"""
+
+    backend = "lru"
+
+    def __init__(self, maxsize=1024, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Returns the value cached for a key or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Caches a value for a key, evicting the least recently used entries"""
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None) -> bool:
+        """Caches a value for a key unless it has one already, True if it was added"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > self.clock():
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def _store(self, key, value, ttl):
+        """Stores an entry, the lock must be held"""
+        self._entries[key] = (value, self.clock() + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        """Removes the entry for a key"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """Removes all of the entries"""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the counters used to monitor the cache"""
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+class SharedCache:
+    """A cache kept in a server shared by every worker
+
+    The client needs the get, set (with ex and nx), delete and scan_iter methods of
+    redis.Redis. The server evicts and expires entries on its own so only the
+    hits, misses and invalidations of this process are counted.
+    """
+
+    backend = "shared"
+
+    def __init__(self, client, ttl=60.0, prefix="promotions:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Returns the value cached for a key or None"""
+        data = self.client.get(self.prefix + str(key))
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key, value, ttl=None):
+        """Caches a value for a key until its time to live runs out"""
+        self.client.set(self.prefix + str(key), pickle.dumps(value), ex=self._expiry(ttl))
+
+    def add(self, key, value, ttl=None) -> bool:
+        """Caches a value for a key unless it has one already, True if it was added"""
+        return bool(self.client.set(self.prefix + str(key), pickle.dumps(value), ex=self._expiry(ttl), nx=True))
+
+    def _expiry(self, ttl) -> int:
+        """Returns the whole seconds an entry stays in the server"""
+        return max(1, int(self.ttl if ttl is None else ttl))
+
+    def delete(self, key):
+        """Removes the entry for a key"""
+        self.invalidations += 1
+        self.client.delete(self.prefix + str(key))
+
+    def clear(self):
+        """Removes all of the entries under the prefix of this cache"""
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.invalidations += len(keys)
+            self.client.delete(*keys)
+
+    def stats(self) -> dict:
+        """Returns the counters used to monitor the cache"""
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+class FakeCacheServer:
+    """An in-memory stand-in for a Redis server used by SharedCache"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """Returns the value stored under a name or None"""
+        with self._lock:
+            value, expires_at = self._data.get(name, (None, None))
+            if expires_at is not None and expires_at <= self.clock():
+                del self._data[name]
+                return None
+            return value
+
+    def set(self, name, value, ex=None, nx=False):
+        """Stores a value under a name for ex seconds, only if it has none when nx is set"""
+        with self._lock:
+            if nx and name in self._data:
+                expires_at = self._data[name][1]
+                if expires_at is None or expires_at > self.clock():
+                    return None
+            self._data[name] = (value, None if ex is None else self.clock() + ex)
+        return True
+
+    def delete(self, *names):
+        """Removes the values stored under the names"""
+        with self._lock:
+            return len([name for name in names if self._data.pop(name, None) is not None])
+
+    def scan_iter(self, match="*"):
+        """Yields the names matching a glob pattern"""
+        with self._lock:
+            names = [name for name in self._data if fnmatch.fnmatchcase(name, match)]
+        yield from names
+
+
+def create_cache(config, prefix, maxsize, ttl):
+    """Creates the cache selected by the CACHE_BACKEND setting
+
+    :param config: the Flask app config with CACHE_BACKEND and CACHE_URL
+    :param prefix: the namespace of the entries in a shared cache
+    :param maxsize: the number of entries kept by a per-process cache
+    :param ttl: the seconds an entry stays in the cache
+    """
+    backend = config.get("CACHE_BACKEND", "lru")
+    if backend == "lru":
+        return LRUCache(maxsize=maxsize, ttl=ttl)
+    if backend == "fake":
+        return SharedCache(FakeCacheServer(), ttl=ttl, prefix=prefix)
+    if backend == "redis":
+        import redis  # pylint: disable=import-outside-toplevel
+        return SharedCache(redis.Redis.from_url(config["CACHE_URL"]), ttl=ttl, prefix=prefix)
+    raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
@@ -1,8 +1,33 @@
 """
 Flask CLI Command Extensions
 """
-from service import app
-from service.models import db
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, text
+from sqlalchemy.exc import DBAPIError
+from service.models import Promotion, db
+from service.sweeper import sweeper
+
+
+def init_app(app):
+    """Adds the commands to the flask command line of an app"""
+    app.cli.add_command(db_create)
+    app.cli.add_command(sweep_expired)
+    app.cli.add_command(unique_names)
+    if click.get_current_context(silent=True) is not None:
+        # Schema migrations for the "flask db" commands, see the migrations
+        # folder. Alembic is slow to import so the web workers skip it
+        from flask_migrate import Migrate  # pylint: disable=import-outside-toplevel
+        Migrate(app, db, include_object=include_object)
+
+
+# Opt-in index created by "flask unique-names on", not by the migrations
+UNIQUE_NAME_INDEX = "ux_promotion_name"
+
+
+def include_object(obj, name, type_, reflected, compare_to):  # pylint: disable=unused-argument
+    """Keeps the opt-in unique name index out of the autogenerated migrations"""
+    return not (type_ == "index" and name == UNIQUE_NAME_INDEX)
 
 
 ######################################################################
@@ -10,12 +35,88 @@ from service.models import db
 # Usage:
 #   flask db-create
 ######################################################################
-@app.cli.command("db-create")
+@click.command("db-create")
+@with_appcontext
 def db_create():
     """
     Recreates a local database. You probably should not use this on
-    production. ;-)
+    production. ;-) Deployments create the schema with "flask db upgrade"
     """
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to deactivate the Promotions that have expired
+# Usage:
+#   flask sweep-expired [--batch-size 1000] [--max-batches 10]
+######################################################################
+@click.command("sweep-expired")
+@click.option("--batch-size", type=click.IntRange(min=1), default=None,
+              help="Promotions deactivated per UPDATE, SWEEP_BATCH_SIZE by default")
+@click.option("--max-batches", type=click.IntRange(min=1), default=None,
+              help="Stop after this many batches")
+@with_appcontext
+def sweep_expired(batch_size, max_batches):
+    """
+    Deactivates the active Promotions that have expired, a batch at a time
+    """
+    if batch_size:
+        sweeper.batch_size = batch_size
+    count = sweeper.sweep(max_batches=max_batches)
+    click.echo(f"Deactivated {count} expired promotions")
+
+
+######################################################################
+# Command to make the Promotion names unique at the database level
+# Usage:
+#   flask unique-names on|off
+######################################################################
+@click.command("unique-names")
+@click.argument("state", type=click.Choice(["on", "off"]))
+@with_appcontext
+def unique_names(state):
+    """
+    Creates or drops a unique index on the Promotion names so the database
+    rejects a second Promotion with the same name with 409 Conflict
+    """
+    if state == "off":
+        db.session.execute(text(f"DROP INDEX IF EXISTS {UNIQUE_NAME_INDEX}"))
+        db.session.commit()
+        click.echo(f"Dropped the index {UNIQUE_NAME_INDEX}")
+        return
+    duplicates = db.session.query(Promotion.name).group_by(Promotion.name).having(func.count() > 1).all()
+    if duplicates:
+        names = ", ".join(sorted(name for name, in duplicates))
+        raise click.ClickException(f"Rename or delete the Promotions with the duplicate names: {names}")
+    db.session.commit()
+    if db.engine.dialect.name == "postgresql":
+        # CONCURRENTLY does not lock out the writes but cannot run in a transaction
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            create_index_concurrently(connection)
+    else:
+        db.session.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {UNIQUE_NAME_INDEX} ON promotion (name)"))
+        db.session.commit()
+    click.echo(f"Created the unique index {UNIQUE_NAME_INDEX}")
+
+
+def create_index_concurrently(connection):
+    """Builds the unique name index without locking out the writes
+
+    A concurrent build that fails leaves an INVALID index behind which
+    IF NOT EXISTS would take for the finished one, so it is dropped and
+    built again.
+    """
+    valid = connection.execute(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                               {"name": UNIQUE_NAME_INDEX}).scalar()
+    if valid is False:
+        click.echo(f"Dropping the invalid index {UNIQUE_NAME_INDEX} left by a failed build")
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {UNIQUE_NAME_INDEX}"))
+    try:
+        connection.execute(text(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {UNIQUE_NAME_INDEX} ON promotion (name)"))
+    except DBAPIError as error:
+        # a duplicate name written during the build fails it and leaves the index invalid
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {UNIQUE_NAME_INDEX}"))
+        raise click.ClickException(f"Could not build the index {UNIQUE_NAME_INDEX}: {error.orig}") from error
@@ -0,0 +1,88 @@
+"""
+Response Compression
+
+Compresses the responses of at least COMPRESS_MIN_SIZE bytes with the
+encoding the client prefers in its Accept-Encoding header, brotli over
+gzip when it accepts both equally. Small bodies are sent as they are
+because compressing them costs more CPU than the bytes it saves.
+
+brotli is used when it is installed and gzip otherwise. Compressed
+responses vary by Accept-Encoding and their strong entity tags are made
+weak, as the bytes differ from the uncompressed representation while the
+weak comparison of If-None-Match still matches them.
+"""
+import gzip
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Media types worth compressing, the rest (images, gzip files) already are
+COMPRESSIBLE = {
+    "application/json",
+    "application/x-ndjson",
+    "application/msgpack",
+    "application/x-msgpack",
+    "text/html",
+    "text/plain",
+}
+
+
+def init_app(app):
+    """Compresses the responses of a Flask app"""
+    app.after_request(compress_response)
+
+
+def encodings() -> list:
+    """Returns the content codings the service can produce, the preferred first"""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def negotiate():
+    """Returns the content coding the client accepts that the service prefers, None for none"""
+    return request.accept_encodings.best_match(encodings())
+
+
+def compress(data: bytes, encoding: str, config) -> bytes:
+    """Compresses a body with a content coding at the configured level"""
+    if encoding == "br":
+        return brotli.compress(data, quality=config["COMPRESS_BROTLI_QUALITY"])
+    return gzip.compress(data, compresslevel=config["COMPRESS_GZIP_LEVEL"])
+
+
+def compress_stream(chunks, encoding: str, config):
+    """Compresses a stream of byte chunks with a content coding as they are produced"""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=config["COMPRESS_BROTLI_QUALITY"])
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(config["COMPRESS_GZIP_LEVEL"], wbits=zlib.MAX_WBITS | 16)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response):
+    """Compresses a response body the client accepts compressed"""
+    if (response.direct_passthrough or response.is_streamed or not 200 <= response.status_code < 300
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE):
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding, current_app.config))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,34 @@
+"""
+Constraint Errors
+
+Tells apart the writes that the database rejected with a constraint.
+Only a duplicate of a unique key is a conflict; the other constraints,
+such as NOT NULL and CHECK, and the values that do not fit their column
+reject bad data. asyncpg checks the values itself and reports the ones
+it cannot send as a plain DBAPIError in the same SQLSTATE class as the
+DataError of Postgres.
+
+The driver error names the columns and the values of the rejected rows,
+and the SQL of the whole statement, so it is only ever logged and the
+clients get a fixed message.
+"""
+from service.common import status
+
+# The SQLSTATE of a write that duplicates a unique key such as a Promotion name
+UNIQUE_VIOLATION = "23505"
+
+# The SQLSTATE class of the values that do not fit their column, such as a
+# name that is too long or "abc" for a number
+DATA_EXCEPTION = "22"
+
+
+def integrity_response(error) -> tuple:
+    """Returns the status code, error and message of a write rejected by a constraint"""
+    if getattr(getattr(error, 'orig', None), 'pgcode', None) == UNIQUE_VIOLATION:
+        return status.HTTP_409_CONFLICT, 'Conflict', "The Promotion conflicts with an existing one"
+    return status.HTTP_400_BAD_REQUEST, 'Bad Request', "The Promotion breaks a database constraint"
+
+
+def is_data_error(error) -> bool:
+    """True when the database or the driver rejected a value that does not fit its column"""
+    return str(getattr(getattr(error, 'orig', None), 'pgcode', None) or '').startswith(DATA_EXCEPTION)
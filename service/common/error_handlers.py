@@ -19,8 +19,12 @@ Error handlers
 
 Handles all of the HTTP Error Codes returning JSON messages
 """
-from service import app, api
-from service.models import DataValidationError, DatabaseConnectionError
+from flask import current_app
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm.exc import StaleDataError
+from service import api
+from service.models import DataValidationError, DatabaseConnectionError, db
+from service.common.constraints import integrity_response
 from . import status
 
 
@@ -33,7 +37,7 @@ from . import status
 def request_validation_error(error):
     """ Handles Value Errors from bad data """
     message = str(error)
-    app.logger.error(message)
+    current_app.logger.error(message)
     return {
         'status_code': status.HTTP_400_BAD_REQUEST,
         'error': 'Bad Request',
@@ -45,9 +49,48 @@ def request_validation_error(error):
 def database_connection_error(error):
     """ Handles Database Errors from connection attempts """
     message = str(error)
-    app.logger.critical(message)
+    current_app.logger.critical(message)
     return {
         'status_code': status.HTTP_503_SERVICE_UNAVAILABLE,
         'error': 'Service Unavailable',
         'message': message
     }, status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+@api.errorhandler(OperationalError)
+@api.errorhandler(PoolTimeoutError)
+def database_unavailable_error(error):
+    """ Handles failed connections, cancelled statements and an exhausted connection pool """
+    try:
+        db.session.rollback()
+    except OperationalError:
+        pass  # the connection is gone and the pool will replace it
+    return database_connection_error(DatabaseConnectionError(
+        f"Database unavailable: {type(error).__name__}: {getattr(error, 'orig', None) or error}"))
+
+
+@api.errorhandler(StaleDataError)
+def stale_data_error(error):
+    """ Handles updates to Promotions that were changed by another request """
+    db.session.rollback()
+    message = "The Promotion was changed by another request, read it again and retry"
+    current_app.logger.warning("%s: %s", message, error)
+    return {
+        'status_code': status.HTTP_409_CONFLICT,
+        'error': 'Conflict',
+        'message': message
+    }, status.HTTP_409_CONFLICT
+
+
+@api.errorhandler(IntegrityError)
+@api.errorhandler(DataError)
+def integrity_error(error):
+    """ Handles writes rejected by a constraint or with a value that does not fit its column """
+    db.session.rollback()
+    code, name, message = integrity_response(error)
+    current_app.logger.warning("%s: %s", message, getattr(error, 'orig', None) or error)
+    return {
+        'status_code': code,
+        'error': name,
+        'message': message
+    }, code
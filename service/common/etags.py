@@ -0,0 +1,35 @@
+"""
+List Entity Tags
+
+Tags a list of Promotions with a hash of its query arguments, its media
+type and a fingerprint of the listed rows, so a client revalidating an
+unchanged list gets 304 Not Modified. Shared by the Flask and the async
+service so both send the same tag for the same list.
+
+The fingerprint of a whole list is an aggregate over every matching row.
+A page is fingerprinted from its own rows instead, which keeps each page
+of a catalog O(page) to tag no matter how large the catalog is.
+"""
+import hashlib
+from service.common.encoder import JSON
+
+
+def list_etag(arguments, fingerprint, mimetype=JSON) -> str:
+    """Returns the entity tag of a list from its query arguments, fingerprint and media type"""
+    count, last_id, versions, last_updated_at = fingerprint
+    # the time is compared as a timestamp as drivers return it in different time zones
+    version = (count, last_id, versions, last_updated_at and last_updated_at.timestamp())
+    arguments = sorted(arguments)
+    if mimetype != JSON:
+        arguments.append(('Accept', mimetype))  # each representation has its own tag
+    return hashlib.sha1(repr((arguments, version)).encode('utf-8')).hexdigest()
+
+
+def page_fingerprint(rows) -> tuple:
+    """Returns the fingerprint of a page from the ids, versions and last updates of its rows"""
+    return (
+        len(rows),
+        tuple(row.id for row in rows),
+        tuple(row.version for row in rows),
+        max((row.last_updated_at for row in rows), default=None),
+    )
@@ -19,20 +19,129 @@ Log Handlers
 
 This module contains utility functions to set up logging
 consistently
+
+The records are formatted as text, or as one JSON object per line with the
+id of the request that logged them when LOG_FORMAT is "json". Unless
+LOG_QUEUE is false the request threads only put the records on a queue and
+a QueueListener thread formats and writes them, so a slow log file or pipe
+never holds up a response. Only LOG_SAMPLE_RATE of the requests log their
+INFO and DEBUG lines, warnings and errors are always logged.
 """
+import atexit
 import logging
+import queue
+import random
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import current_app, g, has_request_context, request
+from service.common import encoder
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Longest request id accepted from a client, longer ones are replaced
+MAX_REQUEST_ID_LENGTH = 128
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
+    handlers = list(gunicorn_logger.handlers)
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
-    )
-    for handler in app.logger.handlers:
+    if app.config["LOG_FORMAT"] == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    for handler in handlers:
         handler.setFormatter(formatter)
+    if app.config["LOG_QUEUE"] and handlers:
+        handler = RecordQueueHandler(queue.SimpleQueue())
+        listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        app.extensions["log_listener"] = listener
+        atexit.register(stop_logging, app)
+        handlers = [handler]
+    # The filter runs on the thread that logs, where the request is known
+    request_filter = RequestFilter()
+    for handler in handlers:
+        handler.addFilter(request_filter)
+    app.logger.handlers = handlers
+    app.before_request(start_request_log)
+    app.after_request(send_request_id)
     app.logger.info("Logging handler established")
+
+
+def stop_logging(app):
+    """Writes the records still queued and stops the listener thread of an app"""
+    listener = app.extensions.pop("log_listener", None)
+    if listener is not None:
+        listener.stop()
+
+
+def start_request_log():
+    """Gives the request an id and decides whether its INFO lines are logged"""
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    if not request_id or len(request_id) > MAX_REQUEST_ID_LENGTH:
+        request_id = uuid.uuid4().hex
+    g.request_id = request_id
+    rate = current_app.config["LOG_SAMPLE_RATE"]
+    g.log_sampled = rate >= 1 or random.random() < rate
+
+
+def send_request_id(response):
+    """Returns the id of the request so clients can find its log lines"""
+    if "request_id" in g:
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+
+class RequestFilter(logging.Filter):
+    """Adds the request id to the records and drops the INFO lines of the requests left out of the sample"""
+
+    def filter(self, record):
+        if not has_request_context():
+            record.request_id = None
+            return True
+        record.request_id = g.get("request_id")
+        return record.levelno >= logging.WARNING or g.get("log_sampled", True)
+
+
+class RecordQueueHandler(QueueHandler):
+    """Puts the records on a queue with their message and traceback rendered
+
+    The arguments and the exception are rendered on the thread that logged
+    them, while they still hold the values of the request, and the listener
+    formats the rest.
+    """
+
+    def prepare(self, record):
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args = message, None
+        record.exc_info, record.exc_text = None, exc_text
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats the records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "module": record.module,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return encoder.dumps(entry).decode("utf-8")
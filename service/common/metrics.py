@@ -0,0 +1,182 @@
+"""
+Metrics
+
+This module instruments the requests served by the Flask app and the
+database connections they use, and renders the metrics in the Prometheus
+text format for the /metrics endpoint.
+
+When PROMETHEUS_MULTIPROC_DIR is set, as gunicorn.conf.py does, every
+worker writes its samples to that folder and /metrics adds up the samples
+of all of the workers no matter which one serves the scrape.
+
+Each request is also profiled on its own: the number of statements it sent
+and the time they took are logged and, when SERVER_TIMING is on, returned
+in a Server-Timing header, and statements slower than SLOW_QUERY_SECONDS
+are logged with their SQL wherever they run.
+"""
+import os
+import time
+from flask import current_app, g, has_app_context, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time spent serving a request",
+    ["method", "route", "status"])
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being served",
+    ["method", "route"], multiprocess_mode="livesum")
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Size of the response bodies",
+    ["method", "route"], buckets=(100, 1000, 10000, 100000, 1000000, 10000000))
+DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries sent while serving a request",
+    ["method", "route"], buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+DB_TIME = Histogram(
+    "http_request_db_seconds", "Time spent in database queries while serving a request",
+    ["method", "route"])
+DB_CONNECTIONS = Gauge(
+    "db_pool_connections", "Database connections of the pool by state",
+    ["state"], multiprocess_mode="livesum")
+DB_CONNECTS = Counter(
+    "db_pool_connects", "Database connections opened by the pool")
+DB_SLOW_QUERIES = Counter(
+    "db_slow_queries", "Database queries slower than SLOW_QUERY_SECONDS")
+
+# Longest a query may take before it is logged as slow, set by init_app()
+_settings = {"slow_query_seconds": 0.1}
+# Longest part of the SQL of a slow query that is logged
+SLOW_QUERY_LOG_LENGTH = 500
+
+
+def init_app(app):
+    """Instruments the requests of a Flask app and the database engines and pools"""
+    _settings["slow_query_seconds"] = app.config["SLOW_QUERY_SECONDS"]
+    app.before_request(_start_request)
+    app.after_request(_record_response)
+    app.teardown_request(_end_request)
+    if not event.contains(Engine, "before_cursor_execute", _before_query):
+        _instrument_engines()
+
+
+def render():
+    """Returns the metrics of every worker in the Prometheus text format and its content type"""
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+######################################################################
+# Request instrumentation
+######################################################################
+
+
+def _route() -> str:
+    """Returns the URL rule that matched the request to keep the labels few"""
+    return request.url_rule.rule if request.url_rule else "<unmatched>"
+
+
+def _start_request():
+    """Starts the clock and the query counters of a request"""
+    g.metrics_start = time.perf_counter()
+    g.metrics_route = _route()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+    g.db_slow_queries = 0
+    REQUESTS_IN_PROGRESS.labels(request.method, g.metrics_route).inc()
+
+
+def _record_response(response):
+    """Records the latency, the size and the database work of a request"""
+    if "metrics_start" not in g:
+        return response
+    route = g.metrics_route
+    REQUEST_LATENCY.labels(request.method, route, response.status_code).observe(
+        time.perf_counter() - g.metrics_start)
+    size = response.calculate_content_length()
+    if size is not None:  # streamed responses have no length up front
+        RESPONSE_SIZE.labels(request.method, route).observe(size)
+    DB_QUERIES.labels(request.method, route).observe(g.db_queries)
+    DB_TIME.labels(request.method, route).observe(g.db_seconds)
+    elapsed = time.perf_counter() - g.metrics_start
+    current_app.logger.info("%s %s sent %s queries in %.1f ms of %.1f ms (%s slow)",
+                            request.method, request.path, g.db_queries, g.db_seconds * 1000,
+                            elapsed * 1000, g.db_slow_queries)
+    if current_app.config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = server_timing(g.db_queries, g.db_seconds, elapsed)
+    return response
+
+
+def server_timing(queries: int, db_seconds: float, elapsed: float) -> str:
+    """Returns the Server-Timing header of the database and total time of a request"""
+    return f'db;dur={db_seconds * 1000:.1f};desc="queries={queries}", app;dur={elapsed * 1000:.1f}'
+
+
+def _end_request(error=None):  # pylint: disable=unused-argument
+    """Takes the request out of the in progress gauge, even when it failed"""
+    if "metrics_route" in g:
+        REQUESTS_IN_PROGRESS.labels(request.method, g.pop("metrics_route")).dec()
+
+
+######################################################################
+# Database instrumentation
+######################################################################
+
+
+def _instrument_engines():
+    """Listens for the queries and the pool events of every SQLAlchemy engine
+
+    Flask-SQLAlchemy creates a new engine when the database URI changes,
+    so the listeners are added to the classes rather than to one engine.
+    """
+    event.listen(Engine, "before_cursor_execute", _before_query)
+    event.listen(Engine, "after_cursor_execute", _after_query)
+    event.listen(Pool, "connect", _on_connect)
+    event.listen(Pool, "close", _on_close)
+    event.listen(Pool, "checkout", _on_checkout)
+    event.listen(Pool, "checkin", _on_checkin)
+
+
+def _before_query(conn, *_):
+    conn.info["metrics_query_start"] = time.perf_counter()
+
+
+def _after_query(conn, _cursor, statement, *_):
+    started = conn.info.pop("metrics_query_start", None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    slow = seconds >= _settings["slow_query_seconds"]
+    if slow:
+        DB_SLOW_QUERIES.inc()
+        if has_app_context():
+            current_app.logger.warning("Slow query took %.1f ms: %s", seconds * 1000,
+                                       " ".join(statement.split())[:SLOW_QUERY_LOG_LENGTH])
+    if has_request_context() and "db_queries" in g:
+        g.db_queries += 1
+        g.db_seconds += seconds
+        g.db_slow_queries += slow
+
+
+def _on_connect(*_):
+    DB_CONNECTS.inc()
+    DB_CONNECTIONS.labels("open").inc()
+
+
+def _on_close(*_):
+    DB_CONNECTIONS.labels("open").dec()
+
+
+def _on_checkout(*_):
+    DB_CONNECTIONS.labels("checked_out").inc()
+
+
+def _on_checkin(*_):
+    DB_CONNECTIONS.labels("checked_out").dec()
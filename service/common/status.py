@@ -17,6 +17,7 @@ HTTP_203_NON_AUTHORITATIVE_INFORMATION = 203
 HTTP_204_NO_CONTENT = 204
 HTTP_205_RESET_CONTENT = 205
 HTTP_206_PARTIAL_CONTENT = 206
+HTTP_207_MULTI_STATUS = 207
 
 # Redirection - 3xx
 HTTP_300_MULTIPLE_CHOICES = 300
@@ -47,6 +48,7 @@ HTTP_414_REQUEST_URI_TOO_LONG = 414
 HTTP_415_UNSUPPORTED_MEDIA_TYPE = 415
 HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE = 416
 HTTP_417_EXPECTATION_FAILED = 417
+HTTP_422_UNPROCESSABLE_ENTITY = 422
 HTTP_428_PRECONDITION_REQUIRED = 428
 HTTP_429_TOO_MANY_REQUESTS = 429
 HTTP_431_REQUEST_HEADER_FIELDS_TOO_LARGE = 431
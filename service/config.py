@@ -12,5 +12,103 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker process. gunicorn runs WEB_CONCURRENCY
+# workers, so the database sees up to WEB_CONCURRENCY * (DB_POOL_SIZE +
+# DB_MAX_OVERFLOW) connections. Connections are checked with a ping before
+# use and replaced after DB_POOL_RECYCLE seconds so a database failover
+# does not leave stale ones in the pool. A request waits DB_POOL_TIMEOUT
+# seconds for a free connection and statements are cancelled after
+# DB_STATEMENT_TIMEOUT milliseconds. Other databases, like the SQLite used
+# by the benchmarks, keep the default pool of SQLAlchemy.
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "30000"))
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes"),
+    "connect_args": {
+        "connect_timeout": DB_CONNECT_TIMEOUT,
+        "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}",
+    },
+} if DATABASE_URI.startswith("postgresql") else {}
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
+
+# Largest page of Promotions that can be requested with ?limit=
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Number of rows fetched per round trip when streaming the export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Number of bulk operations written per flush by POST /api/promotions/bulk
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+
+# Each worker keeps the active Promotions in memory for the list of active
+# Promotions and the cart evaluation engine. Commits send the ids they
+# changed to the other workers through Postgres LISTEN/NOTIFY unless
+# SNAPSHOT_LISTEN is false, and every SNAPSHOT_POLL_SECONDS the rows updated
+# since the last refresh are read again, going back SNAPSHOT_OVERLAP_SECONDS
+# further for clocks that disagree and transactions that commit late.
+SNAPSHOT_LISTEN = os.getenv("SNAPSHOT_LISTEN", "true").lower() in ("true", "1", "yes")
+SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", "5"))
+SNAPSHOT_OVERLAP_SECONDS = float(os.getenv("SNAPSHOT_OVERLAP_SECONDS", "5"))
+
+# Cache of the Promotions read by id: "lru" keeps them in each worker,
+# "redis" shares them through the server at CACHE_URL and "fake" uses an
+# in-memory stand-in for that server
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "lru")
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "4096"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+
+# The aggregates of GET /promotions/stats are kept in the same kind of cache
+# for STATS_CACHE_TTL seconds. Writes clear them in the worker that made
+# them, the other workers catch up when the entry expires.
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "10"))
+
+# The responses to requests sent with an Idempotency-Key are replayed to
+# the retries for IDEMPOTENCY_TTL seconds, at most IDEMPOTENCY_MAXSIZE of
+# them per worker with the lru backend. A retry that arrives while the first
+# request runs gets 409 Conflict for up to IDEMPOTENCY_PENDING_SECONDS.
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAXSIZE = int(os.getenv("IDEMPOTENCY_MAXSIZE", "10000"))
+IDEMPOTENCY_PENDING_SECONDS = float(os.getenv("IDEMPOTENCY_PENDING_SECONDS", "60"))
+
+# Logs are written as text, or as one JSON object per line with the request
+# id when LOG_FORMAT is "json", by a background thread unless LOG_QUEUE is
+# false. Only LOG_SAMPLE_RATE (0-1) of the requests log their INFO and DEBUG
+# lines, warnings and errors are always logged.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() in ("true", "1", "yes")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+
+# Every response reports the number and time of its database queries in a
+# Server-Timing header unless SERVER_TIMING is false, and each query that
+# takes SLOW_QUERY_SECONDS or longer is logged with its SQL.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("true", "1", "yes")
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.1"))
+
+# GET /promotions/changes waits at most CHANGES_MAX_WAIT seconds for the
+# next change. The commits of the same worker answer it at once and those
+# of the other workers within CHANGES_POLL_SECONDS.
+CHANGES_MAX_WAIT = float(os.getenv("CHANGES_MAX_WAIT", "30"))
+CHANGES_POLL_SECONDS = float(os.getenv("CHANGES_POLL_SECONDS", "1"))
+
+# Responses of at least COMPRESS_MIN_SIZE bytes are compressed with brotli
+# (when it is installed) or gzip, whichever the client accepts, at
+# COMPRESS_BROTLI_QUALITY (0-11) or COMPRESS_GZIP_LEVEL (1-9). The low
+# defaults trade a few percent of size for much less CPU per request.
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+
+# The expiry sweeper deactivates expired Promotions SWEEP_BATCH_SIZE at a
+# time, pausing SWEEP_PAUSE_SECONDS between batches. Each worker runs it in
+# the background every SWEEP_INTERVAL_SECONDS, or never when that is 0 and
+# "flask sweep-expired" is scheduled instead.
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "1000"))
+SWEEP_PAUSE_SECONDS = float(os.getenv("SWEEP_PAUSE_SECONDS", "0.1"))
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SWEEP_INTERVAL_SECONDS", "0"))
@@ -0,0 +1,201 @@
+"""
+Promotion Engine
+
+Evaluates shopping carts against the active Promotions
+
+The engine keeps an in-memory table of the best active, non-expired
+Promotion of each type so a cart is priced without touching the database.
+The table is built from the snapshot of the active Promotions and rebuilt
+when the snapshot changes or the day rolls over.
+"""
+import logging
+import math
+import threading
+from datetime import date
+import numpy as np
+from service.models import Promotion, PromotionType, DataValidationError
+from service.snapshot import snapshot
+
+logger = logging.getLogger("flask.app")
+
+
+class ActivePromotions:  # pylint: disable=too-few-public-methods
+    """The best active Promotion of each type on a given day"""
+
+    def __init__(self, on_date, rows=(), version=None):
+        self.on_date = on_date
+        self.version = version      # of the snapshot the rows came from
+        self.count = 0
+        self.best_value = None      # ABS_DISCOUNT with the largest value
+        self.best_percent = None    # PERCENT_DISCOUNT with the largest percent
+        for row in rows:
+            self.add(Promotion.serialize_row(row))
+
+    def add(self, promotion: dict):
+        """Keeps a serialized Promotion if it beats the best one of its type"""
+        self.count += 1
+        if promotion["type"] == PromotionType.ABS_DISCOUNT.name:
+            if (promotion["promotion_value"] or 0) > 0 and (
+                    self.best_value is None
+                    or promotion["promotion_value"] > self.best_value["promotion_value"]):
+                self.best_value = promotion
+        elif promotion["type"] == PromotionType.PERCENT_DISCOUNT.name:
+            if (promotion["promotion_percent"] or 0) > 0 and (
+                    self.best_percent is None
+                    or promotion["promotion_percent"] > self.best_percent["promotion_percent"]):
+                self.best_percent = promotion
+
+    def best_for(self, total: float):
+        """Returns the Promotion with the largest discount on a total and the discount"""
+        best, discount = None, 0.0
+        if self.best_value is not None:
+            best = self.best_value
+            discount = min(float(best["promotion_value"]), total)
+        if self.best_percent is not None:
+            percent_discount = min(total * self.best_percent["promotion_percent"] / 100, total)
+            if percent_discount > discount:
+                best, discount = self.best_percent, percent_discount
+        return best, round(discount, 2)
+
+    def best_for_totals(self, totals):
+        """
+        Works out the best discount for many cart totals at once
+
+        The best absolute and the best percent Promotion dominate the others
+        of their type for every total, so each cart only has to choose between
+        two columns and the whole batch is priced with vectorized math.
+
+        Args:
+            totals (numpy.ndarray): the cart totals
+
+        Returns:
+            tuple: the discounts and the ids of the Promotions applied, 0 for none
+        """
+        discounts = np.zeros_like(totals)
+        ids = np.zeros(totals.shape, dtype=np.int64)
+        if self.best_value is not None:
+            discounts = np.minimum(float(self.best_value["promotion_value"]), totals)
+            ids[:] = self.best_value["id"]
+        if self.best_percent is not None:
+            percent_discounts = np.minimum(
+                totals * (self.best_percent["promotion_percent"] / 100), totals)
+            better = percent_discounts > discounts
+            discounts = np.where(better, percent_discounts, discounts)
+            ids = np.where(better, self.best_percent["id"], ids)
+        ids = np.where(discounts > 0, ids, 0)
+        return np.round(discounts, 2), ids
+
+
+class PromotionEngine:
+    """Prices carts from a cached table of the active Promotions"""
+
+    def __init__(self, source=None):
+        """
+        Args:
+            source (ActiveSnapshot): the snapshot of the active Promotions,
+                the one shared by the service if None
+        """
+        self.source = source or snapshot
+        self._active = None
+        self._lock = threading.Lock()
+
+    def active(self) -> ActivePromotions:
+        """Returns the table of active Promotions, rebuilding it when stale"""
+        state = self.source.current()
+        active = self._active
+        today = date.today()
+        if active is not None and active.on_date == today and active.version == state.version:
+            return active
+        with self._lock:
+            if self._active is active:
+                logger.info("Rebuilding the active promotion table")
+                self._active = ActivePromotions(today, state.active(today), state.version)
+            return self._active
+
+    def evaluate(self, total=None, items=None) -> dict:
+        """
+        Finds the best Promotion for a cart
+
+        Args:
+            total (float): the total price of the cart
+            items (list): the items in the cart with a price and a quantity,
+                used to work out the total when it is not given
+
+        Returns:
+            dict: the total, the discount, the discounted total and the Promotion applied
+        """
+        total = cart_total(total, items)
+        promotion, discount = self.active().best_for(total)
+        return {
+            "total": total,
+            "discount": discount,
+            "discounted_total": round(total - discount, 2),
+            "promotion": promotion,
+        }
+
+    def evaluate_batch(self, totals, currencies=None) -> dict:
+        """
+        Finds the best Promotion for many carts at once
+
+        Args:
+            totals (list): the total price of each cart
+            currencies (list): the currency of each cart, returned as given
+
+        Returns:
+            dict: columns of the discounts, discounted totals and Promotion ids
+        """
+        totals = cart_totals(totals)
+        if currencies is not None and (
+                not isinstance(currencies, list) or len(currencies) != len(totals)):
+            raise DataValidationError(
+                "Invalid carts: currencies must be a list as long as totals")
+        discounts, ids = self.active().best_for_totals(totals)
+        return {
+            "totals": totals.tolist(),
+            "currencies": currencies,
+            "discounts": discounts.tolist(),
+            "discounted_totals": np.round(totals - discounts, 2).tolist(),
+            "promotion_ids": [id_ or None for id_ in ids.tolist()],
+        }
+
+
+def cart_totals(totals):
+    """Validates a list of cart totals and returns them as an array"""
+    if not isinstance(totals, list):
+        raise DataValidationError("Invalid carts: totals must be a list")
+    try:
+        totals = np.asarray(totals, dtype=np.float64)
+    except (TypeError, ValueError) as error:
+        raise DataValidationError(
+            "Invalid carts: totals contained bad data - "
+            "Error message: " + str(error)
+        ) from error
+    if totals.ndim != 1 or (totals < 0).any() or not np.isfinite(totals).all():
+        raise DataValidationError("Invalid carts: totals must be non-negative numbers")
+    return totals
+
+
+def cart_total(total=None, items=None) -> float:
+    """Validates the total of a cart or works it out from its items"""
+    try:
+        if total is None:
+            if items is None:
+                raise DataValidationError("Invalid cart: missing total or items")
+            total = sum(float(item["price"]) * int(item.get("quantity", 1)) for item in items)
+        total = float(total)
+    except KeyError as error:
+        raise DataValidationError(
+            "Invalid cart item: missing " + error.args[0]
+        ) from error
+    except (TypeError, ValueError, AttributeError) as error:
+        raise DataValidationError(
+            "Invalid cart: body of request contained bad data - "
+            "Error message: " + str(error)
+        ) from error
+    if total < 0 or not math.isfinite(total):
+        raise DataValidationError("Invalid cart: total must be a non-negative number")
+    return total
+
+
+# The engine shared by the service routes
+engine = PromotionEngine()
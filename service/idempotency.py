@@ -0,0 +1,115 @@
+"""
+Idempotent Requests
+
+Remembers the responses to the requests sent with an Idempotency-Key
+header so a client that timed out can retry a create, activate or
+deactivate and get the first response back without touching the
+promotion table again.
+
+The responses are kept in the configured cache backend for IDEMPOTENCY_TTL
+seconds. The lru backend keeps at most IDEMPOTENCY_MAXSIZE of them in each
+worker, so a retry that lands on another worker is only caught by the
+shared backends or by the unique index on the Promotion names (see
+"flask unique-names"). A retry that arrives while the first request is
+still running is answered with 409 Conflict.
+"""
+import functools
+import hashlib
+import logging
+from flask import request
+from service import api
+from service.common import status
+from service.common.cache import LRUCache, create_cache
+from service.models import DataValidationError
+
+logger = logging.getLogger("flask.app")
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Marks a key whose first request has not answered yet
+PENDING = "pending"
+
+
+class IdempotencyStore:
+    """A bounded store of the responses to requests with an Idempotency-Key"""
+
+    def __init__(self, maxsize=10000, ttl=86400.0, pending_seconds=60.0):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.pending_seconds = pending_seconds
+
+    def init_app(self, app):
+        """Creates the store from the Flask app config"""
+        self.cache = create_cache(app.config, "idempotency:",
+                                  app.config["IDEMPOTENCY_MAXSIZE"], app.config["IDEMPOTENCY_TTL"])
+        self.pending_seconds = app.config["IDEMPOTENCY_PENDING_SECONDS"]
+
+    def run(self, key: str, function):
+        """
+        Answers a request once per Idempotency-Key
+
+        Args:
+            key (str): the Idempotency-Key header of the request
+            function (callable): handles the request and returns the body,
+                status and headers of the response
+
+        Returns:
+            tuple: the response of the first request sent with the key
+        """
+        if len(key) > MAX_KEY_LENGTH:
+            raise DataValidationError(f"{HEADER} must be at most {MAX_KEY_LENGTH} characters")
+        # the key only replays the same method on the same resource
+        entry_key = hashlib.sha256(f"{request.method} {request.path} {key}".encode("utf-8")).hexdigest()
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        if not self.cache.add(entry_key, (PENDING, fingerprint), ttl=self.pending_seconds):
+            return self.replay(entry_key, fingerprint)
+        try:
+            body, code, headers = response_parts(function())
+        except Exception:
+            self.cache.delete(entry_key)  # a failed request can be retried
+            raise
+        if code >= 500:
+            self.cache.delete(entry_key)
+        else:
+            self.cache.set(entry_key, (fingerprint, body, code, headers))
+        return body, code, headers
+
+    def replay(self, entry_key: str, fingerprint: str):
+        """Returns the stored response of a key, or aborts if it cannot be replayed"""
+        entry = self.cache.get(entry_key)
+        if entry is None:
+            api.abort(status.HTTP_409_CONFLICT, f"The request with this {HEADER} did not finish, retry it")
+        if entry[0] == PENDING:
+            api.abort(status.HTTP_409_CONFLICT,
+                      f"A request with this {HEADER} is still being processed, retry it later")
+        stored_fingerprint, body, code, headers = entry
+        if stored_fingerprint != fingerprint:
+            api.abort(status.HTTP_422_UNPROCESSABLE_ENTITY,
+                      f"The {HEADER} was already used with a different request")
+        logger.info("Replaying the response to %s %s", request.method, request.path)
+        return body, code, {**headers, REPLAYED_HEADER: "true"}
+
+
+def response_parts(result) -> tuple:
+    """Returns the body, status and headers of the value returned by a resource method"""
+    if not isinstance(result, tuple):
+        result = (result,)
+    body, code, headers = result + (200, {})[len(result) - 1:]
+    return body, code, dict(headers)
+
+
+def idempotent(method):
+    """Makes a resource method replay its response to a retry with the same Idempotency-Key"""
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return method(*args, **kwargs)
+        return idempotency.run(key, lambda: method(*args, **kwargs))
+
+    return wrapper
+
+
+idempotency = IdempotencyStore()
@@ -16,26 +16,82 @@ promotion_percent: the percent of the promotion like 50% off
 status (boolean) - True for active promotions
 expiry (date) - Date when the promotion expires
 created_at (date) - Date when the promotion was created
-last_updated_at (date) - Date when the promotion was last updated
+last_updated_at (datetime) - Time in UTC when the promotion was last updated
+version (number) - incremented on every update, used for ETags and optimistic locking
 
 """
+import base64
+import copy
+import json
 import logging
 from enum import Enum
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, event, func, or_, tuple_
+from sqlalchemy import select as select_rows
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, object_session, make_transient_to_detached
+from service.common.cache import LRUCache, create_cache
+from service.common.constraints import integrity_response
 
 logger = logging.getLogger("flask.app")
 
+# Fields exposed by serialize() in the order they are returned
+PROMOTION_FIELDS = (
+    "id",
+    "name",
+    "type",
+    "description",
+    "promotion_value",
+    "promotion_percent",
+    "status",
+    "expiry",
+)
+
+# Types of the values of the other fields stored in a sort cursor
+SORT_VALUE_TYPES = {
+    "id": int,
+    "name": str,
+    "description": str,
+    "promotion_value": int,
+    "promotion_percent": (int, float),
+    "status": bool,
+}
+
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# Functions called with the ids of the Promotions changed by each commit
+change_listeners = []
+
 
 def init_db(app):
     """Initialize the SQLAlchemy app"""
     Promotion.init_db(app)
 
 
+def create_schema():
+    """Creates the missing tables, for tests and local databases without migrations"""
+    db.create_all()
+
+
+def utcnow() -> datetime:
+    """Returns the current time in UTC"""
+    return datetime.now(timezone.utc)
+
+
+def on_change(listener):
+    """Registers a function to call with the ids of the Promotions changed by a commit
+
+    The function gets a set of ids, or None when a bulk query changed an
+    unknown set of Promotions and everything derived from them is stale.
+    """
+    if listener not in change_listeners:
+        change_listeners.append(listener)
+    return listener
+
+
 class DatabaseConnectionError(Exception):
     """Custom Exception when database connection fails"""
 
@@ -44,6 +100,18 @@ class DataValidationError(Exception):
     """Custom Exception with data validation fails"""
 
 
+class BulkResult(str, Enum):
+    """Enumeration of the outcomes of a single bulk operation"""
+
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+    NOT_FOUND = "not_found"
+    INVALID = "invalid"
+    FAILED = "failed"
+    ROLLED_BACK = "rolled_back"
+
+
 class PromotionType(Enum):
     """Enumeration of valid Promotion Types"""
 
@@ -52,7 +120,7 @@ class PromotionType(Enum):
     UNKNOWN = 2
 
 
-class Promotion(db.Model):  # pylint: disable=too-many-instance-attributes
+class Promotion(db.Model):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """
     Class that represents a Promotion
 
@@ -61,6 +129,8 @@ class Promotion(db.Model):  # pylint: disable=too-many-instance-attributes
     """
 
     app = None
+    # Columns of the Promotions read by find(), keyed by id
+    cache = LRUCache()
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(63), nullable=False)
@@ -77,7 +147,25 @@ class Promotion(db.Model):  # pylint: disable=too-many-instance-attributes
                        default=date.today() + timedelta(days=7))
     created_at = db.Column(db.Date(), nullable=False, default=date.today())
     last_updated_at = db.Column(
-        db.Date(), nullable=False, default=date.today())
+        db.DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow)
+    version = db.Column(db.Integer, nullable=False)
+
+    # SQLAlchemy increments the version on every UPDATE and only writes the
+    # row if it still has the version that was read. The server defaults
+    # come back in the RETURNING clause of the INSERT instead of a SELECT.
+    __mapper_args__ = {"version_id_col": version, "eager_defaults": True}
+
+    # Indexes for the lists of active Promotions paged by id, the expiry
+    # lookups of active and inactive Promotions, the filters by type and
+    # the rows the snapshot of active Promotions reads as it refreshes.
+    # Keep them in step with the migrations folder.
+    __table_args__ = (
+        db.Index("ix_promotion_active_id", "id",
+                 postgresql_where=status, sqlite_where=status),
+        db.Index("ix_promotion_status_expiry", "status", "expiry"),
+        db.Index("ix_promotion_type", "type"),
+        db.Index("ix_promotion_last_updated_at", "last_updated_at"),
+    )
 
     # Instance Methods
 
@@ -91,17 +179,17 @@ class Promotion(db.Model):  # pylint: disable=too-many-instance-attributes
         logger.info("Creating %s", self.name)
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
-        db.session.commit()
+        self._commit()
 
     def update(self):
         """
         Updates a Promotion to the database
         """
         logger.info("Saving %s", self.name)
-        self.last_updated_at = date.today()
+        self.last_updated_at = utcnow()
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
-        db.session.commit()
+        self._commit()
 
     def delete(self):
         """ Removes a Promotion from the data store """
@@ -113,13 +201,32 @@ class Promotion(db.Model):  # pylint: disable=too-many-instance-attributes
         """ Activates a Promotion from the data store """
         logger.info("Activating %s", self.name)
         self.status = True
-        db.session.commit()
+        self._commit()
 
     def deactivate(self):
         """ Deactivates a Promotion from the data store """
         logger.info("Deactivating %s", self.name)
         self.status = False
-        db.session.commit()
+        self._commit()
+
+    def _commit(self):
+        """ Commits the session without expiring this Promotion
+
+        Its attributes already hold what the flush wrote, the id comes back
+        from the INSERT and the version and update time are set here, so
+        serializing it after a write does not read the row back. The other
+        objects in the session are expired as the commit would have done.
+        """
+        session = db.session()
+        expire_on_commit, session.expire_on_commit = session.expire_on_commit, False
+        try:
+            session.commit()
+        finally:
+            session.expire_on_commit = expire_on_commit
+        if expire_on_commit:
+            for other in list(session.identity_map.values()):
+                if other is not self:
+                    session.expire(other)
 
     def serialize(self) -> dict:
         """ Serializes a Promotion into a dictionary """
@@ -171,12 +278,41 @@ class Promotion(db.Model):  # pylint: disable=too-many-instance-attributes
             ) from error
         return self
 
+    def etag(self) -> str:
+        """ Returns the entity tag of this version of the Promotion """
+        return f"{self.id}-{self.version}"
+
+    def columns(self) -> dict:
+        """ Returns the values of all of the database columns """
+        return {column.key: getattr(self, column.key) for column in self.__table__.columns}
+
+    @staticmethod
+    def serialize_row(row) -> dict:
+        """ Serializes a row of selected columns into a dictionary
+
+        :param row: a row returned by a query built with Promotion.select()
+        :type row: sqlalchemy.engine.Row
+
+        :return: a dictionary with the same format as serialize() for the selected fields
+        :rtype: dict
+
+        """
+        data = row._asdict()
+        if data.get("type") is not None:
+            data["type"] = data["type"].name  # convert enum to string
+        if data.get("expiry") is not None:
+            data["expiry"] = data["expiry"].isoformat()
+        return data
+
     # Class Methods
 
     @classmethod
     def init_db(cls, app: Flask):
         """Initializes the database session
 
+        Nothing connects to the database until the first query, the tables
+        are created by the migrations or by create_schema()
+
         :param app: the Flask app
         :type data: Flask
 
@@ -186,7 +322,8 @@ class Promotion(db.Model):  # pylint: disable=too-many-instance-attributes
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        cls.cache = create_cache(app.config, "promotion:",
+                                 app.config["CACHE_MAXSIZE"], app.config["CACHE_TTL"])
 
     @classmethod
     def all(cls):
@@ -195,10 +332,139 @@ class Promotion(db.Model):  # pylint: disable=too-many-instance-attributes
         return cls.query.all()
 
     @classmethod
-    def find(cls, by_id):
-        """ Finds a Promotion by it's ID """
+    def find(cls, by_id, cached=True):
+        """ Finds a Promotion by it's ID
+
+        The columns of the Promotions found are cached so repeated lookups
+        do not query the database. A cached Promotion is merged into the
+        session without loading it, so it can be updated and deleted like
+        one that was just read. Pass cached=False to read the latest version
+        before an update, as another worker may have changed it since it was
+        cached and the update would fail the version check.
+        """
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.get(by_id)
+        columns = cls.cache.get(str(by_id)) if cached else None
+        if columns is not None:
+            promotion = cls(**columns)
+            make_transient_to_detached(promotion)
+            return db.session.merge(promotion, load=False)
+        promotion = cls.query.get(by_id)
+        if promotion is not None:
+            cls.cache.set(str(by_id), promotion.columns())
+        return promotion
+
+    @classmethod
+    def fingerprint(cls, status=None, **filters) -> tuple:
+        """ Returns a summary of the Promotions that changes whenever one of them does
+
+        :param status: only summarize Promotions with this status if not None
+        :type status: bool
+        :param filters: the other filters of PromotionQuery, the sort order is ignored
+
+        :return: the count, the largest id, the sum of the versions and the
+            time of the last update of the Promotions
+        :rtype: tuple
+
+        """
+        return tuple(db.session.execute(PromotionQuery(status=status, **filters).summary()).one())
+
+    @classmethod
+    def find_active(cls, on_date=None):
+        """ Returns the rows of the Promotions that are active and not expired
+
+        :param on_date: the day to check the expiry against, today if None
+        :type on_date: date
+
+        :return: a query of rows with all of the serialized fields
+        :rtype: sqlalchemy.orm.Query
+
+        """
+        on_date = on_date or date.today()
+        logger.info("Processing active query for %s ...", on_date)
+        return cls.select(status=True).filter(cls.expiry >= on_date)
+
+    @classmethod
+    def deactivate_expired(cls, batch_size, on_date=None) -> set:
+        """ Deactivates one batch of the active Promotions that have expired
+
+        A single UPDATE deactivates the batch and bumps the versions. Rows
+        locked by other transactions are skipped rather than waited for,
+        so the sweep never blocks live requests and picks them up next time.
+
+        :param batch_size: the largest number of Promotions to deactivate
+        :type batch_size: int
+        :param on_date: Promotions that expired before this day are deactivated, today if None
+        :type on_date: date
+
+        :return: the ids of the Promotions that were deactivated
+        :rtype: set
+
+        """
+        on_date = on_date or date.today()
+        table = cls.__table__
+        # the batch is materialized so the planner cannot run the locking
+        # subquery again and deactivate more than batch_size rows
+        expired = (
+            db.select(table.c.id)
+            .where(table.c.status, table.c.expiry < on_date)
+            .order_by(table.c.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .cte("expired")
+            .prefix_with("MATERIALIZED")
+        )
+        statement = (
+            table.update()
+            .where(table.c.id == expired.c.id)
+            .values(status=False, version=table.c.version + 1)
+            .returning(table.c.id)
+        )
+        ids = {row.id for row in db.session.execute(statement)}
+        _session_changes(db.session()).update(ids)
+        db.session.commit()
+        logger.info("Deactivated %s expired Promotions", len(ids))
+        return ids
+
+    @classmethod
+    def set_status(cls, status, ids=None, dry_run=False, **filters) -> list:
+        """ Activates or deactivates every Promotion that matches a filter in one UPDATE
+
+        Only the Promotions whose status changes are written and have their
+        versions bumped, so applying the same change again touches nothing.
+
+        :param status: True to activate the Promotions, False to deactivate them
+        :type status: bool
+        :param ids: only the Promotions with these ids
+        :type ids: list
+        :param dry_run: only count the Promotions that would change
+        :type dry_run: bool
+        :param filters: the PromotionQuery filters, at least one of them or the ids is required
+
+        :return: the sorted ids of the Promotions that changed, or the count of them for a dry run
+        :rtype: list or int
+
+        """
+        search = PromotionQuery(**filters)
+        criteria = list(search.criteria)
+        if ids is not None:
+            criteria.append(cls.id.in_(ids))
+        if not criteria:
+            raise DataValidationError("A status change needs ids or at least one filter")
+        criteria.append(cls.status == (not status))
+        if dry_run:
+            return db.session.query(func.count(cls.id)).filter(*criteria).scalar()
+        table = cls.__table__
+        statement = (
+            table.update()
+            .where(*criteria)
+            .values(status=status, version=table.c.version + 1)
+            .returning(table.c.id)
+        )
+        changed = sorted(row.id for row in db.session.execute(statement))
+        _session_changes(db.session()).update(changed)
+        db.session.commit()
+        logger.info("%s %s Promotions", "Activated" if status else "Deactivated", len(changed))
+        return changed
 
     @classmethod
     def find_by_status(cls, status) -> list:
@@ -213,3 +479,522 @@ class Promotion(db.Model):  # pylint: disable=too-many-instance-attributes
         """
         logger.info("Processing status query for %s ...", status)
         return cls.query.filter(cls.status == status)
+
+    @classmethod
+    def select(cls, fields=None, status=None, **filters):
+        """ Returns a query of row tuples for the given fields
+
+        Only the requested columns are selected and the rows are not loaded
+        into the ORM identity map. The id and the sort fields are always
+        selected because they are the keys used for keyset pagination.
+
+        :param fields: the names of the fields to select, all fields if None
+        :type fields: list
+        :param status: only select Promotions with this status if not None
+        :type status: bool
+        :param filters: the other filters and the sort order of PromotionQuery
+
+        :return: a query of rows ordered by the sort fields and then the id
+        :rtype: sqlalchemy.orm.Query
+
+        """
+        return PromotionQuery(status=status, **filters).select(fields)
+
+    @classmethod
+    def find_page(cls, limit=None, cursor=None, fields=None, status=None, **filters) -> list:
+        """ Returns a page of serialized Promotions using keyset pagination
+
+        :param limit: the maximum number of Promotions to return, all if None
+        :type limit: int
+        :param cursor: only return Promotions after this one, see PromotionQuery.after()
+        :type cursor: int or str
+        :param fields: the names of the fields to return, all fields if None
+        :type fields: list
+        :param status: only return Promotions with this status if not None
+        :type status: bool
+        :param filters: the other filters and the sort order of PromotionQuery
+
+        :return: a list of dictionaries in the format of serialize()
+        :rtype: list
+
+        """
+        query = cls.select_page(limit, cursor, fields, status, **filters)
+        return [cls.serialize_row(row) for row in query]
+
+    @classmethod
+    def select_page(cls, limit=None, cursor=None, fields=None, status=None, **filters):
+        """ Returns a query of the row tuples of a page of Promotions
+
+        Takes the same arguments as find_page() but leaves the rows as they
+        come from the database so they can be encoded without serializing
+        them first.
+
+        :return: a query of rows in sort order
+        :rtype: sqlalchemy.orm.Query
+
+        """
+        logger.info("Processing page query after cursor %s ...", cursor)
+        search = PromotionQuery(status=status, **filters)
+        query = search.after(search.select(fields), cursor)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    @classmethod
+    def stream(cls, batch_size, cursor=None, fields=None, status=None, **filters):
+        """ Yields serialized Promotions from a server-side cursor
+
+        Rows are fetched from the database batch_size at a time so memory
+        stays flat no matter how many Promotions there are.
+
+        :param batch_size: the number of rows to fetch per round trip
+        :type batch_size: int
+        :param cursor: only return Promotions after this one, see PromotionQuery.after()
+        :type cursor: int or str
+        :param fields: the names of the fields to return, all fields if None
+        :type fields: list
+        :param status: only return Promotions with this status if not None
+        :type status: bool
+        :param filters: the other filters and the sort order of PromotionQuery
+
+        :return: a generator of dictionaries in the format of serialize()
+        :rtype: generator
+
+        """
+        logger.info("Processing streaming export in batches of %s ...", batch_size)
+        search = PromotionQuery(status=status, **filters)
+        query = search.after(search.select(fields), cursor)
+        for row in query.yield_per(batch_size):
+            yield cls.serialize_row(row)
+
+    @classmethod
+    def bulk_write(cls, operations, batch_size, atomic=False) -> list:
+        """ Applies create, update and delete operations in one transaction
+
+        Operations are validated with deserialize() and written batch_size
+        at a time: one SELECT loads the rows to update or delete and a
+        single flush sends the batched INSERTs, UPDATEs and DELETEs. Each
+        batch runs in a savepoint so a failing batch does not undo the
+        others, unless atomic is set in which case any failure rolls back
+        every operation.
+
+        :param operations: dictionaries with an "op" of create, update or delete,
+            the "id" to update or delete and the Promotion "data" to write
+        :type operations: list
+        :param batch_size: the number of operations written per flush
+        :type batch_size: int
+        :param atomic: roll back all of the operations if any of them fails
+        :type atomic: bool
+
+        :return: one result per operation with its index, op, id, result and error
+        :rtype: list
+
+        """
+        logger.info("Processing %s bulk operations in batches of %s ...",
+                    len(operations), batch_size)
+        results = []
+        for start in range(0, len(operations), batch_size):
+            batch = cls._bulk_batch(operations[start:start + batch_size], start)
+            results.extend(batch)
+            if atomic and any(result["error"] for result in batch):
+                db.session.rollback()
+                for result in results:
+                    if not result["error"]:
+                        result["result"] = BulkResult.ROLLED_BACK.value
+                        if result["op"] == "create":
+                            result["id"] = None
+                for index in range(start + batch_size, len(operations)):
+                    results.append(cls._bulk_result(
+                        index, operations[index], BulkResult.ROLLED_BACK,
+                        error="Not applied because another operation failed"))
+                return results
+        db.session.commit()
+        return results
+
+    @classmethod
+    def _bulk_batch(cls, operations, offset) -> list:
+        """ Writes one batch of bulk operations inside a savepoint """
+        results = []
+        staged = []
+        ids = [id_ for id_ in map(cls._bulk_id, operations) if id_ is not None]
+        savepoint = db.session.begin_nested()
+        try:
+            found = {promotion.id: promotion for promotion in cls.query.filter(cls.id.in_(ids))} if ids else {}
+            for index, operation in enumerate(operations, offset):
+                result = cls._bulk_stage(index, operation, found)
+                results.append(result)
+                if not result["error"]:
+                    staged.append(result)
+            db.session.flush()
+            savepoint.commit()
+        except SQLAlchemyError as error:
+            savepoint.rollback()
+            message = integrity_response(error)[2]
+            logger.warning("Bulk batch at %s failed: %s", offset, getattr(error, "orig", None) or error)
+            # every operation of the batch failed but the invalid ones keep their reason
+            rejected = {result["index"]: result for result in results if result["error"]}
+            return [rejected.get(index) or cls._bulk_result(index, operation, BulkResult.FAILED, error=message)
+                    for index, operation in enumerate(operations, offset)]
+        for result in staged:
+            promotion = result.pop("promotion", None)
+            if promotion is not None:
+                result["id"] = promotion.id
+        return results
+
+    @classmethod
+    def _bulk_stage(cls, index, operation, found) -> dict:  # pylint: disable=too-many-return-statements
+        """ Validates one bulk operation and adds its change to the session """
+        if not isinstance(operation, dict):
+            return cls._bulk_result(index, operation, BulkResult.INVALID, error="Operation must be an object")
+        kind = operation.get("op")
+        if kind == "create":
+            return cls._bulk_create(index, operation)
+        if kind not in ("update", "delete"):
+            return cls._bulk_result(index, operation, BulkResult.INVALID, error=f"Invalid op: {kind}")
+        if cls._bulk_id(operation) is None:
+            return cls._bulk_result(index, operation, BulkResult.INVALID,
+                                    error=f"Invalid id for {kind}: {operation.get('id')}")
+        promotion = found.get(operation["id"])
+        if promotion is None:
+            return cls._bulk_result(index, operation, BulkResult.NOT_FOUND,
+                                    error=f"Promotion with id '{operation['id']}' was not found.")
+        if kind == "delete":
+            db.session.delete(promotion)
+            return cls._bulk_result(index, operation, BulkResult.DELETED)
+        return cls._bulk_update(index, operation, promotion)
+
+    @classmethod
+    def _bulk_create(cls, index, operation) -> dict:
+        """ Adds a new Promotion from a bulk create operation to the session """
+        try:
+            promotion = cls().deserialize(operation.get("data"))
+        except DataValidationError as error:
+            return cls._bulk_result(index, operation, BulkResult.INVALID, error=str(error))
+        db.session.add(promotion)
+        result = cls._bulk_result(index, operation, BulkResult.CREATED)
+        result["promotion"] = promotion
+        return result
+
+    @classmethod
+    def _bulk_update(cls, index, operation, promotion) -> dict:
+        """ Applies a bulk update operation to a Promotion in the session """
+        try:
+            promotion.deserialize(operation.get("data"))
+        except DataValidationError as error:
+            db.session.expire(promotion)  # discard the partial changes
+            return cls._bulk_result(index, operation, BulkResult.INVALID, error=str(error))
+        promotion.last_updated_at = utcnow()
+        return cls._bulk_result(index, operation, BulkResult.UPDATED)
+
+    @staticmethod
+    def _bulk_id(operation):
+        """ Returns the id of a bulk operation, None unless it is an integer and not a boolean """
+        id_ = operation.get("id") if isinstance(operation, dict) else None
+        return id_ if isinstance(id_, int) and not isinstance(id_, bool) else None
+
+    @classmethod
+    def _bulk_result(cls, index, operation, result, error=None) -> dict:
+        """ Builds the result of a single bulk operation """
+        kind = operation.get("op") if isinstance(operation, dict) else None
+        return {
+            "index": index,
+            "op": kind,
+            "id": None if kind == "create" else cls._bulk_id(operation),
+            "result": result.value,
+            "error": error,
+        }
+
+
+######################################################################
+#  Q U E R Y   B U I L D E R
+######################################################################
+class PromotionQuery:
+    """
+    Builds the query of a filtered and sorted list of Promotions
+
+    Every filter is pushed down into the WHERE clause so only the matching
+    rows leave the database. The sort is a comma separated list of fields,
+    each prefixed with - to sort it in descending order, and the id always
+    breaks the ties so the rows have a stable order to page through.
+    Promotions without a value or a percent sort as if it was 0.
+    """
+
+    def __init__(self, *, status=None, promotion_type=None, expires_before=None,  # pylint: disable=too-many-arguments
+                 expires_after=None, min_value=None, max_value=None, name=None, sort=None):
+        """
+        Args:
+            status (bool): only Promotions with this status
+            promotion_type (PromotionType or str): only Promotions of this type
+            expires_before (date): only Promotions that expire before this day
+            expires_after (date): only Promotions that expire after this day
+            min_value (int): only Promotions with a promotion_value of at least this
+            max_value (int): only Promotions with a promotion_value of at most this
+            name (str): only Promotions with a name that starts with this prefix
+            sort (str): the fields to sort by, like "-expiry,name"
+        """
+        self.criteria = []
+        if status is not None:
+            self.criteria.append(Promotion.status == status)
+        if promotion_type is not None:
+            self.criteria.append(Promotion.type == self._promotion_type(promotion_type))
+        if expires_before is not None:
+            self.criteria.append(Promotion.expiry < expires_before)
+        if expires_after is not None:
+            self.criteria.append(Promotion.expiry > expires_after)
+        if min_value is not None:
+            self.criteria.append(Promotion.promotion_value >= min_value)
+        if max_value is not None:
+            self.criteria.append(Promotion.promotion_value <= max_value)
+        if name:
+            self.criteria.append(Promotion.name.startswith(name, autoescape=True))
+        self.keys = self._sort_keys(sort)
+
+    @staticmethod
+    def _promotion_type(value) -> PromotionType:
+        """Returns the PromotionType with a given name"""
+        if isinstance(value, PromotionType):
+            return value
+        try:
+            return PromotionType[value]
+        except KeyError as error:
+            raise DataValidationError(f"Invalid type: {value}") from error
+
+    @staticmethod
+    def _sort_keys(sort) -> list:
+        """Parses a sort into a list of field names and descending flags ending with the id"""
+        keys = []
+        for field in (sort or "").split(","):
+            field = field.strip()
+            if not field:
+                continue
+            descending = field.startswith("-")
+            field = field.lstrip("-")
+            if field not in PROMOTION_FIELDS:
+                raise DataValidationError(f"Invalid sort field: {field}")
+            if field not in [name for name, _ in keys]:
+                keys.append((field, descending))
+            if field == "id":
+                break  # the id is unique so later fields never break a tie
+        if "id" not in [name for name, _ in keys]:
+            keys.append(("id", False))
+        return keys
+
+    @property
+    def by_id(self) -> bool:
+        """True when the Promotions are sorted by ascending id"""
+        return self.keys == [("id", False)]
+
+    @staticmethod
+    def _sort_column(field):
+        """Returns the expression a field is sorted by"""
+        column = getattr(Promotion, field)
+        if field in ("promotion_value", "promotion_percent"):
+            return func.coalesce(column, 0)
+        return column
+
+    @staticmethod
+    def check_fields(fields=None) -> list:
+        """Returns the names of the fields to select, all fields if None"""
+        fields = list(fields or PROMOTION_FIELDS)
+        unknown = [name for name in fields if name not in PROMOTION_FIELDS]
+        if unknown:
+            raise DataValidationError(
+                "Invalid field(s): " + ", ".join(unknown)
+            )
+        return fields
+
+    def where(self, query):
+        """Adds the filters to a query"""
+        return query.filter(*self.criteria)
+
+    def select(self, fields=None):
+        """
+        Returns a query of row tuples for the given fields in sort order
+
+        Args:
+            fields (list): the names of the fields to select, all fields if None
+        """
+        return self.order(self.where(db.session.query(*self.columns(fields))))
+
+    def statement(self, fields=None):
+        """
+        Returns a core select of the same rows as select(), for connections
+        that are not the session like the ones of the async service
+
+        Args:
+            fields (list): the names of the fields to select, all fields if None
+        """
+        return self.order(self.where(select_rows(*self.columns(fields))))
+
+    def summary(self):
+        """Returns a core select of the count, largest id, sum of versions and last update"""
+        return self.where(select_rows(
+            func.count(Promotion.id), func.max(Promotion.id),
+            func.sum(Promotion.version), func.max(Promotion.last_updated_at)
+        ))
+
+    def columns(self, fields=None) -> list:
+        """Returns the columns to select for some fields, with the sort fields first"""
+        fields = self.check_fields(fields)
+        for name, _ in reversed(self.keys):
+            if name not in fields:
+                fields.insert(0, name)
+        return [getattr(Promotion, name) for name in fields]
+
+    def order(self, query):
+        """Sorts a query by the sort fields"""
+        return query.order_by(*[
+            self._sort_column(name).desc() if descending else self._sort_column(name)
+            for name, descending in self.keys
+        ])
+
+    def after(self, query, cursor):
+        """
+        Only keeps the rows that come after a cursor in sort order
+
+        Args:
+            query (Query): a query built by select()
+            cursor (int or str): the id of the last Promotion when sorted by id,
+                otherwise the opaque cursor returned by cursor()
+        """
+        if cursor is None:
+            return query
+        values = self.decode(cursor)
+        columns = [self._sort_column(name) for name, _ in self.keys]
+        directions = {descending for _, descending in self.keys}
+        if directions == {False}:
+            return query.filter(tuple_(*columns) > tuple_(*values))
+        if directions == {True}:
+            return query.filter(tuple_(*columns) < tuple_(*values))
+        # mixed directions are compared one key at a time
+        return query.filter(or_(*[
+            and_(*[column == value for column, value in zip(columns[:index], values[:index])],
+                 columns[index] < values[index] if self.keys[index][1]
+                 else columns[index] > values[index])
+            for index in range(len(columns))
+        ]))
+
+    def cursor(self, promotion: dict) -> str:
+        """Returns the cursor of the page after a serialized Promotion"""
+        if self.by_id:
+            return str(promotion["id"])
+        values = [promotion[name] for name, _ in self.keys]
+        data = json.dumps([0 if value is None else value for value in values])
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+    def decode(self, cursor) -> list:
+        """Returns the sort values stored in a cursor"""
+        try:
+            if self.by_id:
+                values = [int(cursor)]
+                if values[0] < 0:
+                    raise ValueError(cursor)
+                return values
+            data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            values = json.loads(data)
+            if not isinstance(values, list) or len(values) != len(self.keys):
+                raise ValueError(cursor)
+            return [self._decode_value(name, value)
+                    for (name, _), value in zip(self.keys, values)]
+        except (TypeError, ValueError, KeyError) as error:
+            raise DataValidationError(f"Invalid cursor: {cursor}") from error
+
+    @staticmethod
+    def _decode_value(name, value):
+        """Converts a serialized sort value back to the type of its column"""
+        if name == "type":
+            return PromotionType[value]
+        if name == "expiry":
+            return date.fromisoformat(value)
+        if not isinstance(value, SORT_VALUE_TYPES[name]):
+            raise TypeError(f"{name} must be a {SORT_VALUE_TYPES[name]}")
+        return value
+
+
+######################################################################
+#  C H A N G E   T R A C K I N G
+######################################################################
+# The ids of the Promotions written by a flush are collected on the
+# session and handed to the change listeners once the outermost commit
+# succeeds. A savepoint that is rolled back forgets the ids written in it.
+
+# The session.info keys of the changes of a transaction, saved at each savepoint
+CHANGE_KEYS = ["promotion_changes", "promotion_changes_all"]
+
+
+def _session_changes(session) -> set:
+    """Returns the ids changed in the current transaction of a session"""
+    return session.info.setdefault("promotion_changes", set())
+
+
+def pending_changes(session):
+    """Returns the ids the current transaction of a session changed so far, None for all"""
+    if session.info.get("promotion_changes_all"):
+        return None
+    return set(session.info.get("promotion_changes", ()))
+
+
+@event.listens_for(Promotion, "after_insert")
+@event.listens_for(Promotion, "after_update")
+@event.listens_for(Promotion, "after_delete")
+def _track_change(mapper, connection, target):  # pylint: disable=unused-argument
+    """Records the id of a Promotion written by the ORM"""
+    session = object_session(target)
+    if session is not None:
+        _session_changes(session).add(target.id)
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _track_bulk_change(context):
+    """Records that a bulk query changed an unknown set of Promotions"""
+    if context.mapper.class_ is Promotion:
+        context.session.info["promotion_changes_all"] = True
+
+
+@event.listens_for(Session, "after_transaction_create")
+def _save_changes(session, transaction):
+    """Saves the changes made before a savepoint in case it is rolled back"""
+    if transaction.nested:
+        saved = {key: copy.copy(session.info[key]) for key in CHANGE_KEYS if key in session.info}
+        session.info.setdefault("promotion_savepoints", []).append(saved)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_changes(session):
+    """Calls the change listeners with the ids written by the transaction"""
+    if session.in_nested_transaction():  # a savepoint keeps its changes for the outer commit
+        session.info["promotion_savepoints"].pop()
+        return
+    session.info.pop("promotion_savepoints", None)
+    changed_all = session.info.pop("promotion_changes_all", False)
+    ids = session.info.pop("promotion_changes", set())
+    if not (changed_all or ids):
+        return
+    for listener in change_listeners:
+        listener(None if changed_all else ids)
+
+
+@on_change
+def invalidate_cache(ids):
+    """Removes the changed Promotions from the cache used by find(), all of them for None"""
+    if ids is None:
+        Promotion.cache.clear()
+        return
+    for promotion_id in ids:
+        Promotion.cache.delete(str(promotion_id))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_changes(session, previous_transaction):
+    """Forgets the ids written by a transaction or a savepoint that was rolled back"""
+    if previous_transaction.nested:
+        saved = session.info["promotion_savepoints"].pop()
+    elif previous_transaction.parent is None:
+        saved = {}
+        session.info.pop("promotion_savepoints", None)
+    else:
+        return
+    for key in CHANGE_KEYS:
+        session.info.pop(key, None)
+    session.info.update(saved)
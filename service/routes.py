@@ -8,20 +8,44 @@ Paths:
 ------
 GET /api/promotions - Returns a list all of the Promotions
 GET /api/promotions?status=true - Returns a list of Promotions with active status
+GET /api/promotions?limit=100&cursor={id} - Returns a page of Promotions after the given id
+GET /api/promotions?fields=id,name - Returns a list of Promotions with only the given fields
+GET /api/promotions?type=ABS_DISCOUNT&min_value=10&name=Sale - Returns a list of the matching Promotions
+GET /api/promotions?sort=-expiry,name - Returns a list of Promotions in the given order
+GET /api/promotions/export - Streams all of the Promotions as newline-delimited JSON
+GET /api/promotions with Accept: application/msgpack - Returns a list of Promotions as MessagePack
 GET /api/promotions/{id} - Returns the Promotion with a given id number
 POST /api/promotions - Creates a new Promotion record in the database
+POST /api/promotions/bulk - Creates, updates and deletes many Promotions in one request
+POST /api/promotions/evaluate - Returns the best active Promotion for a cart
+POST /api/promotions/evaluate/batch - Returns the best active Promotion for many carts
 PUT /api/promotions/{id} - Updates a Promotion record in the database
 DELETE /api/promotions/{id} - Deletes a Promotion record in the database
 PUT /api/promotions/activate/{id} - Activates a Promotion
 DELETE /api/promotions/activate/{id} - Deactivates a Promotion
+POST /api/promotions/activate - Activates every Promotion that matches a filter
+POST /api/promotions/deactivate - Deactivates every Promotion that matches a filter
 """
-
-from flask import jsonify, request
-from flask_restx import Resource, fields, reqparse, inputs
-from service.models import Promotion, PromotionType
-from service.common import status  # HTTP Status Codes
+import json
+from datetime import date, timezone
+from flask import Blueprint, current_app, jsonify, request, stream_with_context
+from werkzeug.http import http_date, quote_etag
+from flask_restx import Resource, fields, reqparse, inputs, marshal
+from service.models import PROMOTION_FIELDS, Promotion, PromotionQuery, PromotionType, BulkResult, DataValidationError
+from service.changes import CREATE, DELETE, RESYNC, UPDATE, feed
+from service.engine import engine
+from service.snapshot import snapshot
+from service.stats import stats
+from service.idempotency import HEADER as IDEMPOTENCY_HEADER, idempotent
+from service.common import metrics, status  # HTTP Status Codes
+from service.common.compression import compress_stream, negotiate
+from service.common.encoder import JSON, MSGPACK, RowEncoder, msgpack, packb
+from service.common.etags import list_etag, page_fingerprint
 # Import Flask application
-from . import app, api
+from service import api
+
+# The routes outside of the /api prefix
+blueprint = Blueprint("service", __name__)
 
 
 ######################################################################
@@ -29,21 +53,44 @@ from . import app, api
 ######################################################################
 
 
-@app.route("/health")
+@blueprint.route("/health")
 def healthcheck():
     """Let them know our heart is still beating"""
     return jsonify(status=200, message="Healthy"), status.HTTP_200_OK
 
 
+######################################################################
+# GET CACHE STATISTICS
+######################################################################
+
+
+@blueprint.route("/cache")
+def cache_stats():
+    """Returns the hit, miss and eviction counters of the Promotion cache"""
+    return jsonify(Promotion.cache.stats()), status.HTTP_200_OK
+
+
+######################################################################
+# GET METRICS
+######################################################################
+
+
+@blueprint.route("/metrics")
+def metrics_endpoint():
+    """Returns the request and database metrics in the Prometheus text format"""
+    body, content_type = metrics.render()
+    return current_app.response_class(body, status=status.HTTP_200_OK, content_type=content_type)
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
 
 
-@app.route("/")
+@blueprint.route("/")
 def index():
     """Base URL for our service"""
-    return app.send_static_file("index.html")
+    return current_app.send_static_file("index.html")
 
 
 ######################################################################
@@ -75,10 +122,215 @@ promotion_model = api.inherit(
     }
 )
 
+bulk_operation_model = api.model('BulkOperation', {
+    'op': fields.String(required=True, enum=['create', 'update', 'delete'],
+                        description='The operation to apply'),
+    'id': fields.Integer(description='The id of the Promotion to update or delete'),
+    'data': fields.Nested(create_model, description='The Promotion to create or update'),
+})
+
+bulk_item_model = api.model('BulkItemResult', {
+    'index': fields.Integer(description='The position of the operation in the request'),
+    'op': fields.String(description='The operation that was requested'),
+    'id': fields.Integer(description='The id of the Promotion that was written'),
+    'result': fields.String(enum=[result.value for result in BulkResult],
+                            description='The outcome of the operation'),
+    'error': fields.String(description='Why the operation failed'),
+})
+
+bulk_result_model = api.model('BulkResult', {
+    'succeeded': fields.Integer(description='The number of operations applied'),
+    'failed': fields.Integer(description='The number of operations not applied'),
+    'results': fields.List(fields.Nested(bulk_item_model)),
+})
+
+status_filter_model = api.model('StatusFilter', {
+    'ids': fields.List(fields.Integer, description='Only the Promotions with these ids'),
+    'type': fields.String(enum=PromotionType._member_names_,  # pylint: disable=W0212
+                          description='Only the Promotions of this type'),
+    'expires_before': fields.Date(description='Only the Promotions that expire before this date'),
+    'expires_after': fields.Date(description='Only the Promotions that expire after this date'),
+    'min_value': fields.Integer(description='Only the Promotions with a promotion_value of at least this'),
+    'max_value': fields.Integer(description='Only the Promotions with a promotion_value of at most this'),
+    'name': fields.String(description='Only the Promotions with a name starting with this prefix'),
+    'dry_run': fields.Boolean(default=False, description='Only count the Promotions that would change'),
+})
+
+# The JSON types of the fields of a StatusFilter
+STATUS_FILTER_TYPES = {
+    'ids': list, 'type': str, 'expires_before': str, 'expires_after': str,
+    'min_value': int, 'max_value': int, 'name': str, 'dry_run': bool,
+}
+
+status_change_model = api.model('StatusChange', {
+    'status': fields.Boolean(description='The status the Promotions were given'),
+    'dry_run': fields.Boolean(description='True when nothing was changed'),
+    'count': fields.Integer(description='The number of Promotions that changed, or would change'),
+    'ids': fields.List(fields.Integer, description='The ids of the Promotions that changed, empty for a dry run'),
+})
+
+cart_item_model = api.model('CartItem', {
+    'price': fields.Float(required=True, description='The unit price of the item'),
+    'quantity': fields.Integer(description='The number of units, 1 if not given'),
+})
+
+cart_model = api.model('Cart', {
+    'total': fields.Float(description='The total price of the cart'),
+    'items': fields.List(fields.Nested(cart_item_model),
+                         description='The items in the cart, used when there is no total'),
+})
+
+evaluation_model = api.model('Evaluation', {
+    'total': fields.Float(description='The total price of the cart'),
+    'discount': fields.Float(description='The discount of the best Promotion'),
+    'discounted_total': fields.Float(description='The price of the cart after the discount'),
+    'promotion': fields.Nested(promotion_model, allow_null=True,
+                               description='The best Promotion, null if none applies'),
+})
+
+batch_carts_model = api.model('BatchCarts', {
+    'totals': fields.List(fields.Float, required=True,
+                          description='The total price of each cart'),
+    'currencies': fields.List(fields.String,
+                              description='The currency of each cart, returned as given'),
+})
+
+batch_evaluation_model = api.model('BatchEvaluation', {
+    'totals': fields.List(fields.Float, description='The total price of each cart'),
+    'currencies': fields.List(fields.String, description='The currency of each cart'),
+    'discounts': fields.List(fields.Float, description='The best discount for each cart'),
+    'discounted_totals': fields.List(fields.Float,
+                                     description='The price of each cart after the discount'),
+    'promotion_ids': fields.List(fields.Integer,
+                                 description='The id of the Promotion applied to each cart, null if none'),
+})
+
+bucket_model = api.model('Bucket', {
+    'from': fields.Float(description='The lower bound of the bucket, null if it has none'),
+    'to': fields.Float(description='The upper bound of the bucket (excluded), null if it has none'),
+    'count': fields.Integer(description='The number of Promotions in the bucket'),
+})
+
+distribution_model = api.model('Distribution', {
+    'count': fields.Integer(description='The number of Promotions with a value'),
+    'min': fields.Float(description='The smallest value'),
+    'max': fields.Float(description='The largest value'),
+    'avg': fields.Float(description='The average value'),
+    'histogram': fields.List(fields.Nested(bucket_model)),
+})
+
+stats_model = api.model('PromotionStats', {
+    'as_of': fields.Date(description='The day the expiry buckets count from'),
+    'total': fields.Integer(description='The number of Promotions'),
+    'by_status': fields.Raw(description='The number of active and inactive Promotions'),
+    'by_type': fields.Raw(description='The number of active and inactive Promotions of each type'),
+    'expiring': fields.Raw(description='The number of active Promotions by the days until they expire'),
+    'promotion_value': fields.Nested(distribution_model),
+    'promotion_percent': fields.Nested(distribution_model),
+})
+
+
+change_model = api.model('PromotionChange', {
+    'seq': fields.Integer(description='The number of the change, the changes are numbered in commit order'),
+    'id': fields.String(description='The id of the Promotion that changed, null for a resync'),
+    'operation': fields.String(enum=[CREATE, UPDATE, DELETE, RESYNC],
+                               description='What was done to the Promotion, resync when any of them may have changed'),
+    'changed_at': fields.DateTime(description='When the change was made'),
+    'promotion': fields.Nested(promotion_model, allow_null=True,
+                               description='The Promotion as it is now, null once it is deleted'),
+})
+
+change_feed_model = api.model('PromotionChanges', {
+    'changes': fields.List(fields.Nested(change_model), description='The changes after since, oldest first'),
+    'next': fields.Integer(description='The since of the next request, the number of the last change returned'),
+    'more': fields.Boolean(description='True when the page is full and more changes may follow'),
+})
+
+
+def page_size(value) -> int:
+    """Parses a page size between 1 and the MAX_PAGE_SIZE of the app"""
+    return inputs.int_range(1, current_app.config['MAX_PAGE_SIZE'])(value)
+
+
+page_size.__schema__ = {'type': 'integer', 'minimum': 1}
+
+
+def wait_seconds(value) -> float:
+    """Parses a number of seconds to wait that is not negative"""
+    seconds = float(value)
+    if seconds < 0:
+        raise ValueError('wait must not be negative')
+    return seconds
+
+
+wait_seconds.__schema__ = {'type': 'number', 'minimum': 0}
+
+# the header that makes a retried write replay the first response
+IDEMPOTENCY_PARAMS = {IDEMPOTENCY_HEADER: {
+    'in': 'header', 'type': 'string', 'required': False,
+    'description': 'A unique key for the request, a retry with the same key gets the first response back',
+}}
+
 # query string arguments
 promotion_args = reqparse.RequestParser()
 promotion_args.add_argument(
-    'status', type=inputs.boolean, required=False, help='List Promotions by status')
+    'status', type=inputs.boolean, location='args', required=False,
+    help='List Promotions by status')
+promotion_args.add_argument(
+    'limit', type=page_size,
+    location='args', required=False,
+    help='Maximum number of Promotions to return in one page')
+promotion_args.add_argument(
+    'type', type=str, location='args', required=False,
+    choices=PromotionType._member_names_,  # pylint: disable=W0212
+    help='List Promotions by type')
+promotion_args.add_argument(
+    'expires_before', type=inputs.date_from_iso8601, location='args', required=False,
+    help='List Promotions that expire before this date')
+promotion_args.add_argument(
+    'expires_after', type=inputs.date_from_iso8601, location='args', required=False,
+    help='List Promotions that expire after this date')
+promotion_args.add_argument(
+    'min_value', type=int, location='args', required=False,
+    help='List Promotions with a promotion_value of at least this')
+promotion_args.add_argument(
+    'max_value', type=int, location='args', required=False,
+    help='List Promotions with a promotion_value of at most this')
+promotion_args.add_argument(
+    'name', type=str, location='args', required=False,
+    help='List Promotions with a name starting with this prefix')
+promotion_args.add_argument(
+    'sort', type=str, location='args', required=False,
+    help='Comma separated list of the fields to sort by, prefix a field with - to sort descending')
+promotion_args.add_argument(
+    'cursor', type=str, location='args', required=False,
+    help='Return the page of Promotions after this cursor (from X-Next-Cursor)')
+promotion_args.add_argument(
+    'fields', type=str, location='args', required=False,
+    help='Comma separated list of the Promotion fields to return')
+
+change_args = reqparse.RequestParser()
+change_args.add_argument(
+    'since', type=inputs.natural, location='args', required=False, default=0,
+    help='Return the changes after this number (from next), 0 for all of them')
+change_args.add_argument(
+    'limit', type=page_size, location='args', required=False,
+    help='Maximum number of changes to return in one page')
+change_args.add_argument(
+    'wait', type=wait_seconds, location='args', required=False, default=0.0,
+    help='Seconds to wait for a change when there are none, at most CHANGES_MAX_WAIT')
+
+bulk_args = reqparse.RequestParser()
+bulk_args.add_argument(
+    'batch_size', type=inputs.positive, location='args', required=False,
+    help='Number of operations written per batch')
+bulk_args.add_argument(
+    'atomic', type=inputs.boolean, location='args', required=False, default=False,
+    help='Roll back every operation if any of them fails')
+
+# the export streams every matching Promotion so it takes no page size
+export_args = promotion_args.copy()
+export_args.remove_argument('limit')
 
 
 ######################################################################
@@ -99,20 +351,27 @@ class PromotionResource(Resource):
     # RETRIEVE A PROMOTION
     # ------------------------------------------------------------------
     @api.doc('get_promotions')
+    @api.response(200, 'Success', promotion_model)
+    @api.response(304, 'Promotion not modified')
     @api.response(404, 'Promotion not found')
-    @api.marshal_with(promotion_model)
+    @api.header('ETag', 'The version of the Promotion')
+    @api.header('Last-Modified', 'When the Promotion was last updated')
     def get(self, promotion_id):
         """
         Retrieve a single Promotion
         This endpoint will return a Promotion based on its id
         """
-        app.logger.info("Request for promotion with id: %s", promotion_id)
+        current_app.logger.info("Request for promotion with id: %s", promotion_id)
         promotion = Promotion.find(promotion_id)
         if not promotion:
             abort(status.HTTP_404_NOT_FOUND,
                   f"Promotion with id '{promotion_id}' was not found.")
-        app.logger.info("Returning promotion: %s", promotion.name)
-        return promotion.serialize(), status.HTTP_200_OK
+        headers = version_headers(promotion)
+        if is_not_modified(promotion.etag(), promotion.last_updated_at):
+            current_app.logger.info("Promotion %s not modified", promotion_id)
+            return not_modified(headers)
+        current_app.logger.info("Returning promotion: %s", promotion.name)
+        return marshal(promotion.serialize(), promotion_model), status.HTTP_200_OK, headers
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING PROMOTION
@@ -120,6 +379,8 @@ class PromotionResource(Resource):
     @api.doc('update_promotions')
     @api.response(400, 'The posted Promotion data was not valid')
     @api.response(404, 'Promotion not found')
+    @api.response(409, 'Promotion was changed by another request')
+    @api.response(412, 'Promotion does not match the If-Match header')
     @api.expect(promotion_model)
     @api.marshal_with(promotion_model)
     def put(self, promotion_id):
@@ -127,17 +388,19 @@ class PromotionResource(Resource):
         Update a Promotion
         This endpoint will update a Promotion based on the body that is posted
         """
-        app.logger.info(
+        current_app.logger.info(
             "Request to update promotion with id: %s", promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = Promotion.find(promotion_id, cached=False)
         if not promotion:
             abort(status.HTTP_404_NOT_FOUND,
                   f"Promotion with id '{promotion_id}' was not found.")
-        app.logger.debug('Payload = %s', api.payload)
+        if request.if_match and not request.if_match.contains(promotion.etag()):
+            abort(status.HTTP_412_PRECONDITION_FAILED,
+                  f"Promotion with id '{promotion_id}' has been changed.")
+        current_app.logger.debug('Payload = %s', api.payload)
         promotion.deserialize(request.get_json())
-        promotion.id = promotion_id
         promotion.update()
-        return promotion.serialize(), status.HTTP_200_OK
+        return promotion.serialize(), status.HTTP_200_OK, version_headers(promotion)
 
     # ------------------------------------------------------------------
     # DELETE A PROMOTION
@@ -149,12 +412,12 @@ class PromotionResource(Resource):
         Delete a Promotion
         This endpoint will delete a Promotion based the id specified in the path
         """
-        app.logger.info(
+        current_app.logger.info(
             "Request to delete a promotion with id: %s", promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = Promotion.find(promotion_id, cached=False)
         if promotion:
             promotion.delete()
-            app.logger.info(
+            current_app.logger.info(
                 "Promotion with ID [%s] delete complete.", promotion_id)
         return '', status.HTTP_204_NO_CONTENT
 
@@ -171,45 +434,297 @@ class PromotionCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc('list_promotions')
     @api.expect(promotion_args, validate=True)
-    @api.marshal_list_with(promotion_model)
+    @api.produces([JSON, MSGPACK])
+    @api.response(200, 'Success', [promotion_model])
+    @api.response(304, 'Promotions not modified')
+    @api.header('ETag', 'The version of the list of Promotions')
+    @api.header('Last-Modified', 'When a listed Promotion was last updated')
+    @api.header('Link', 'The URL of the next page when there are more Promotions')
+    @api.header('X-Next-Cursor', 'The cursor of the next page when there are more Promotions')
     def get(self):
         """Returns a list of all of the Promotions"""
-        app.logger.info("Request for promotion list")
-        promotions = []
-        status_type = request.args.get("status")
-        if status_type:
-            app.logger.info('Filtering by status: %s', status_type)
-            promotions = Promotion.find_by_status(status_type)
+        current_app.logger.info("Request for promotion list")
+        args = promotion_args.parse_args()
+        filters = list_filters(args)
+        current_app.logger.info('Filtering by: %s', filters)
+        search = PromotionQuery(**filters)
+        field_names = None
+        if args['fields']:
+            field_names = [name.strip() for name in args['fields'].split(',')]
+
+        # active Promotions listed by id are read from the in-memory snapshot
+        state = snapshot.current() if from_snapshot(search, filters) else None
+
+        # the fingerprint changes whenever a Promotion in the list does, a
+        # page is summarized from its own rows so paging stays O(page)
+        page = None
+        if state is not None:
+            fingerprint = state.fingerprint(filters['promotion_type'])
+        elif args['limit']:
+            page = list_page(search, filters, args, field_names)
+            fingerprint = page_fingerprint(page[0])
         else:
-            app.logger.info('Returning unfiltered list.')
-            promotions = Promotion.all()
-
-        results = [promotion.serialize() for promotion in promotions]
-        app.logger.info('[%s] Promotions returned', len(results))
-        return results, status.HTTP_200_OK
+            fingerprint = Promotion.fingerprint(**filters)
+        mimetype = response_type(JSON)
+        etag = list_etag(request.args.items(multi=True), fingerprint, mimetype)
+        headers = {'ETag': quote_etag(etag), 'Vary': 'Accept'}
+        if fingerprint[3] is not None:
+            headers['Last-Modified'] = http_date(fingerprint[3])
+        if request.if_none_match.contains_weak(etag):
+            current_app.logger.info('Promotion list not modified')
+            return not_modified(headers)
+
+        rows, columns = page or list_page(search, filters, args, field_names, state)
+        rows = next_page(search, rows, args['limit'], headers)
+
+        current_app.logger.info('[%s] Promotions returned', len(rows))
+        # the rows are encoded straight to the JSON of the documented model
+        # instead of being serialized and then marshalled field by field
+        encoder = RowEncoder(promotion_model, columns, mask=field_names)
+        return current_app.response_class(encoder.encode(rows) if mimetype == JSON else encoder.pack(rows),
+                                          status=status.HTTP_200_OK, mimetype=mimetype, headers=headers)
 
     # ------------------------------------------------------------------
     # ADD A NEW PROMOTION
     # ------------------------------------------------------------------
-    @api.doc('create_promotions')
+    @api.doc('create_promotions', params=IDEMPOTENCY_PARAMS)
     @api.response(400, 'The posted data was not valid')
+    @api.response(409, 'A Promotion with the name exists or the Idempotency-Key is in use')
+    @api.response(422, 'The Idempotency-Key was used with a different request')
     @api.expect(create_model)
     @api.marshal_with(promotion_model, code=201)
+    @idempotent
     def post(self):
         """
         Creates a Promotion
         This endpoint will create a Promotion based on the data
         in the body that is posted
         """
-        app.logger.info("Request to create a Promotion")
+        current_app.logger.info("Request to create a Promotion")
         promotion = Promotion()
-        app.logger.debug('Payload = %s', api.payload)
+        current_app.logger.debug('Payload = %s', api.payload)
         promotion.deserialize(api.payload)
         promotion.create()
-        app.logger.info('Promotion with new id [%s] created!', promotion.id)
+        current_app.logger.info('Promotion with new id [%s] created!', promotion.id)
         location_url = api.url_for(
             PromotionResource, promotion_id=promotion.id, _external=True)
-        return promotion.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
+        headers = {'Location': location_url, **version_headers(promotion)}
+        return promotion.serialize(), status.HTTP_201_CREATED, headers
+
+
+######################################################################
+#  PATH: /promotions/export
+######################################################################
+@api.route('/promotions/export')
+class ExportResource(Resource):
+    """ Streams the whole Promotion catalog """
+
+    # ------------------------------------------------------------------
+    # EXPORT ALL PROMOTIONS
+    # ------------------------------------------------------------------
+    @api.doc('export_promotions')
+    @api.expect(export_args, validate=True)
+    @api.produces(['application/x-ndjson', MSGPACK])
+    @api.response(200, 'One JSON Promotion per line, or a stream of MessagePack Promotions')
+    def get(self):
+        """
+        Exports all of the Promotions
+        This endpoint streams one Promotion per line using a server-side cursor,
+        or MessagePack when the client asks for it, compressed with brotli or
+        gzip when the client accepts them
+        """
+        current_app.logger.info("Request to export promotions")
+        args = export_args.parse_args()
+        field_names = None
+        if args['fields']:
+            field_names = [name.strip() for name in args['fields'].split(',')]
+        rows = (export_row(row, field_names) for row in Promotion.stream(
+            current_app.config['EXPORT_BATCH_SIZE'],
+            cursor=args['cursor'],
+            fields=field_names,
+            **list_filters(args)
+        ))
+        mimetype = response_type('application/x-ndjson')
+        if mimetype == MSGPACK:
+            chunks = (packb(row) for row in rows)
+        else:
+            chunks = ((json.dumps(row) + '\n').encode('utf-8') for row in rows)
+
+        headers = {'Vary': 'Accept, Accept-Encoding'}
+        encoding = negotiate()
+        if encoding:
+            chunks = compress_stream(chunks, encoding, current_app.config)
+            headers['Content-Encoding'] = encoding
+        return current_app.response_class(
+            stream_with_context(chunks),
+            status=status.HTTP_200_OK,
+            mimetype=mimetype,
+            headers=headers
+        )
+
+
+######################################################################
+#  PATH: /promotions/stats
+######################################################################
+@api.route('/promotions/stats')
+class StatsResource(Resource):
+    """ Aggregate statistics of the Promotions """
+
+    # ------------------------------------------------------------------
+    # SUMMARIZE THE PROMOTIONS
+    # ------------------------------------------------------------------
+    @api.doc('promotion_stats')
+    @api.response(200, 'Success', stats_model)
+    def get(self):
+        """
+        Returns statistics of the Promotions
+        This endpoint counts the Promotions by status, by type and by how soon
+        the active ones expire, and summarizes their values in one query
+        """
+        current_app.logger.info("Request for promotion stats")
+        # the aggregates are JSON already, so skip marshalling them
+        return stats.summary(), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /promotions/changes
+######################################################################
+@api.route('/promotions/changes')
+class ChangesResource(Resource):
+    """ The feed of the changes made to the Promotions """
+
+    # ------------------------------------------------------------------
+    # LIST THE CHANGES
+    # ------------------------------------------------------------------
+    @api.doc('promotion_changes')
+    @api.expect(change_args, validate=True)
+    @api.response(200, 'Success', change_feed_model)
+    @api.header('Link', 'The URL of the next page when more changes may follow')
+    def get(self):
+        """
+        Returns the changes made to the Promotions
+        This endpoint returns the changes committed after the since number, oldest
+        first, each with the Promotion as it is now, and waits up to wait seconds
+        for the next change when there are none and the server runs threads
+        """
+        args = change_args.parse_args()
+        limit = args['limit'] or current_app.config['MAX_PAGE_SIZE']
+        current_app.logger.info("Request for the promotion changes after %s", args['since'])
+        # a single threaded server would serve nothing else while it waits
+        wait = args['wait'] if request.environ.get('wsgi.multithread') else 0.0
+        changes = feed.read(args['since'], limit, wait)
+        last = changes[-1]['seq'] if changes else args['since']
+        headers = {}
+        more = len(changes) == limit
+        if more:
+            next_url = api.url_for(
+                ChangesResource, _external=True, **{**request.args.to_dict(), 'since': last})
+            headers['Link'] = f'<{next_url}>; rel="next"'
+        current_app.logger.info('[%s] Promotion changes returned', len(changes))
+        body = {'changes': changes, 'next': last, 'more': more}
+        return marshal(body, change_feed_model), status.HTTP_200_OK, headers
+
+
+######################################################################
+#  PATH: /promotions/bulk
+######################################################################
+@api.route('/promotions/bulk')
+class BulkResource(Resource):
+    """ Applies many Promotion changes in a single transaction """
+
+    # ------------------------------------------------------------------
+    # CREATE, UPDATE AND DELETE MANY PROMOTIONS
+    # ------------------------------------------------------------------
+    @api.doc('bulk_promotions')
+    @api.expect(bulk_args, [bulk_operation_model])
+    @api.response(207, 'Some of the operations failed', bulk_result_model)
+    @api.response(400, 'The posted operations were not valid')
+    @api.marshal_with(bulk_result_model)
+    def post(self):
+        """
+        Creates, updates and deletes Promotions in bulk
+        This endpoint takes a JSON array or newline-delimited JSON stream of
+        operations and reports the result of each one
+        """
+        current_app.logger.info("Request to apply bulk promotion operations")
+        args = bulk_args.parse_args()
+        operations = read_operations()
+        results = Promotion.bulk_write(
+            operations,
+            args['batch_size'] or current_app.config['BULK_BATCH_SIZE'],
+            atomic=args['atomic']
+        )
+        # a failed atomic write rolls back the operations that had succeeded
+        succeeded = len([result for result in results
+                         if not result['error'] and result['result'] != BulkResult.ROLLED_BACK.value])
+        failed = len(results) - succeeded
+        current_app.logger.info('[%s] bulk operations applied, [%s] failed', succeeded, failed)
+        code = status.HTTP_200_OK
+        if failed:
+            code = status.HTTP_400_BAD_REQUEST if args['atomic'] else status.HTTP_207_MULTI_STATUS
+        return {
+            'succeeded': succeeded,
+            'failed': failed,
+            'results': results
+        }, code
+
+
+######################################################################
+#  PATH: /promotions/evaluate
+######################################################################
+@api.route('/promotions/evaluate')
+class EvaluateResource(Resource):
+    """ Prices carts against the active Promotions """
+
+    # ------------------------------------------------------------------
+    # EVALUATE A CART
+    # ------------------------------------------------------------------
+    @api.doc('evaluate_cart')
+    @api.response(400, 'The posted cart was not valid')
+    @api.expect(cart_model)
+    @api.marshal_with(evaluation_model)
+    def post(self):
+        """
+        Evaluates a cart
+        This endpoint will return the active, non-expired Promotion that gives
+        the largest discount on the cart and the discounted price
+        """
+        current_app.logger.info("Request to evaluate a cart")
+        cart = api.payload
+        if not isinstance(cart, dict):
+            raise DataValidationError("Invalid cart: body of request must be an object")
+        result = engine.evaluate(cart.get('total'), cart.get('items'))
+        return result, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /promotions/evaluate/batch
+######################################################################
+@api.route('/promotions/evaluate/batch')
+class BatchEvaluateResource(Resource):
+    """ Prices many carts at once against the active Promotions """
+
+    # ------------------------------------------------------------------
+    # EVALUATE MANY CARTS
+    # ------------------------------------------------------------------
+    @api.doc('evaluate_carts')
+    @api.response(200, 'Success', batch_evaluation_model)
+    @api.response(400, 'The posted carts were not valid')
+    @api.expect(batch_carts_model)
+    def post(self):
+        """
+        Evaluates a batch of carts
+        This endpoint takes columns of cart totals and returns columns with the
+        best discount of each cart, priced with vectorized math
+        """
+        current_app.logger.info("Request to evaluate a batch of carts")
+        carts = api.payload
+        if not isinstance(carts, dict):
+            raise DataValidationError("Invalid carts: body of request must be an object")
+        result = engine.evaluate_batch(carts.get('totals'), carts.get('currencies'))
+        current_app.logger.info('[%s] carts evaluated', len(result['totals']))
+        # the columns are plain lists already, so skip marshalling them item by item
+        return result, status.HTTP_200_OK
 
 
 ######################################################################
@@ -223,45 +738,96 @@ class ActivateResource(Resource):
     # ------------------------------------------------------------------
     # ACTIVATE A PROMOTION
     # ------------------------------------------------------------------
-    @api.doc('activate_promotion')
+    @api.doc('activate_promotion', params=IDEMPOTENCY_PARAMS)
     @api.response(404, 'Promotion not found')
+    @idempotent
     def put(self, promotion_id):
         """
         Activates a Promotion
         This endpoint will Activate a Promotion based on the id specified in the path
         """
-        app.logger.info(
+        current_app.logger.info(
             "Request to Activate a promotion with id: %s", promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = Promotion.find(promotion_id, cached=False)
         if not promotion:
             abort(status.HTTP_404_NOT_FOUND,
                   f"Promotion with id '{promotion_id}' was not found.")
         promotion.activate()
-        app.logger.info(
+        current_app.logger.info(
             "Promotion with ID [%s] activation complete.", promotion_id)
         return promotion.serialize(), status.HTTP_200_OK
 
     # ------------------------------------------------------------------
     # DEACTIVATE A PROMOTION
     # ------------------------------------------------------------------
-    @api.doc('deactivate_promotion')
+    @api.doc('deactivate_promotion', params=IDEMPOTENCY_PARAMS)
     @api.response(404, 'Promotion not found')
+    @idempotent
     def delete(self, promotion_id):
         """
         Deactivates a Promotion
         This endpoint will Deactivate a Promotion based on the id specified in the path
         """
-        app.logger.info(
+        current_app.logger.info(
             "Request to Deactivate a promotion with id: %s", promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = Promotion.find(promotion_id, cached=False)
         if not promotion:
             abort(status.HTTP_404_NOT_FOUND,
                   f"Promotion with id '{promotion_id}' was not found.")
         promotion.deactivate()
-        app.logger.info(
+        current_app.logger.info(
             "Promotion with ID [%s] deactivation complete.", promotion_id)
         return promotion.serialize(), status.HTTP_200_OK
 
+
+######################################################################
+#  PATH: /promotions/activate
+######################################################################
+@api.route('/promotions/activate')
+class BulkActivateResource(Resource):
+    """ Activates many Promotions at once """
+
+    # ------------------------------------------------------------------
+    # ACTIVATE THE MATCHING PROMOTIONS
+    # ------------------------------------------------------------------
+    @api.doc('activate_promotions', params=IDEMPOTENCY_PARAMS)
+    @api.response(400, 'The posted filter was not valid')
+    @api.expect(status_filter_model)
+    @api.marshal_with(status_change_model)
+    @idempotent
+    def post(self):
+        """
+        Activates the Promotions that match a filter
+        This endpoint activates every inactive Promotion that matches the ids
+        and filters in the body with a single UPDATE
+        """
+        return change_status(True)
+
+
+######################################################################
+#  PATH: /promotions/deactivate
+######################################################################
+@api.route('/promotions/deactivate')
+class BulkDeactivateResource(Resource):
+    """ Deactivates many Promotions at once """
+
+    # ------------------------------------------------------------------
+    # DEACTIVATE THE MATCHING PROMOTIONS
+    # ------------------------------------------------------------------
+    @api.doc('deactivate_promotions', params=IDEMPOTENCY_PARAMS)
+    @api.response(400, 'The posted filter was not valid')
+    @api.expect(status_filter_model)
+    @api.marshal_with(status_change_model)
+    @idempotent
+    def post(self):
+        """
+        Deactivates the Promotions that match a filter
+        This endpoint deactivates every active Promotion that matches the ids
+        and filters in the body with a single UPDATE
+        """
+        return change_status(False)
+
+
 ######################################################################
 #  UTILITY FUNCTIONS
 ######################################################################
@@ -269,5 +835,162 @@ class ActivateResource(Resource):
 
 def abort(error_code: int, message: str):
     """Logs errors before aborting"""
-    app.logger.error(message)
+    current_app.logger.error(message)
     api.abort(error_code, message)
+
+
+def version_headers(promotion) -> dict:
+    """Returns the ETag and Last-Modified headers of a Promotion"""
+    return {
+        'ETag': quote_etag(promotion.etag()),
+        'Last-Modified': http_date(promotion.last_updated_at),
+    }
+
+
+def is_not_modified(etag: str, last_modified) -> bool:
+    """Checks the conditional GET headers against the current version of a resource"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def not_modified(headers: dict):
+    """Returns an empty 304 Not Modified response"""
+    return current_app.response_class(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+
+def response_type(default: str) -> str:
+    """Returns MessagePack when the client prefers it to the default media type and it is installed"""
+    if msgpack is None:
+        return default
+    best = request.accept_mimetypes.best_match([default, MSGPACK, 'application/x-msgpack'], default)
+    return default if best == default else MSGPACK
+
+
+# The columns added to the rows of a page of the list for page_fingerprint()
+VERSION_COLUMNS = (Promotion.version, Promotion.last_updated_at)
+
+
+def next_page(search, rows, limit, headers: dict) -> list:
+    """Returns the rows of a page and links the next page when one more row was read"""
+    if not limit or len(rows) <= limit:
+        return rows
+    rows = rows[:limit]
+    next_cursor = search.cursor(Promotion.serialize_row(rows[-1]))
+    next_url = api.url_for(
+        PromotionCollection, _external=True,
+        **{**request.args.to_dict(), 'cursor': next_cursor})
+    headers['Link'] = f'<{next_url}>; rel="next"'
+    headers['X-Next-Cursor'] = next_cursor
+    return rows
+
+
+def export_row(row: dict, field_names=None) -> dict:
+    """Returns an exported Promotion with its id as a string and only the requested fields,
+    the way the list and GET marshal it: the sort keys and id selected along with them are dropped"""
+    if field_names is not None:
+        row = {name: value for name, value in row.items() if name in field_names}
+    if 'id' in row:
+        row['id'] = str(row['id'])
+    return row
+
+
+def list_filters(args) -> dict:
+    """Returns the PromotionQuery filters and sort order of the parsed list arguments"""
+    return {
+        'status': args['status'],
+        'promotion_type': args['type'],
+        'expires_before': args['expires_before'],
+        'expires_after': args['expires_after'],
+        'min_value': args['min_value'],
+        'max_value': args['max_value'],
+        'name': args['name'],
+        'sort': args['sort'],
+    }
+
+
+def from_snapshot(search, filters) -> bool:
+    """True when a list only asks for the active Promotions, maybe of one type, by id"""
+    others = [value for name, value in filters.items()
+              if name not in ('status', 'promotion_type', 'sort')]
+    return filters['status'] is True and search.by_id and all(value is None for value in others)
+
+
+def list_page(search, filters, args, field_names, state=None) -> tuple:
+    """Returns the rows of a page of the list and the names of their columns
+
+    The page is read from a version of the snapshot of the active
+    Promotions when one is given and from the database otherwise.
+    """
+    # fetch one extra row to find out if there is a next page
+    limit = args['limit'] + 1 if args['limit'] else None
+    if state is None:
+        query = Promotion.select_page(limit=limit, cursor=args['cursor'], fields=field_names, **filters)
+        if limit:
+            query = query.add_columns(*VERSION_COLUMNS)  # for page_fingerprint()
+        return query.all(), [column['name'] for column in query.column_descriptions]
+    PromotionQuery.check_fields(field_names)
+    after = search.decode(args['cursor'])[0] if args['cursor'] else None
+    return state.page(limit, after, filters['promotion_type']), list(PROMOTION_FIELDS)
+
+
+def change_status(active: bool):
+    """Activates or deactivates the Promotions that match the filter in the body of the request"""
+    current_app.logger.info("Request to %s promotions by filter", "activate" if active else "deactivate")
+    ids, filters, dry_run = status_filters(api.payload)
+    if dry_run:
+        count = Promotion.set_status(active, ids, dry_run=True, **filters)
+        current_app.logger.info('[%s] Promotions would change', count)
+        return {'status': active, 'dry_run': True, 'count': count, 'ids': []}, status.HTTP_200_OK
+    changed = Promotion.set_status(active, ids, **filters)
+    current_app.logger.info('[%s] Promotions changed', len(changed))
+    return {'status': active, 'dry_run': False, 'count': len(changed), 'ids': changed}, status.HTTP_200_OK
+
+
+def status_filters(data) -> tuple:
+    """Returns the ids, the PromotionQuery filters and the dry run flag of a status change"""
+    if not isinstance(data, dict):
+        raise DataValidationError("Invalid filter: body of request must be an object")
+    for name, value in data.items():
+        if name not in STATUS_FILTER_TYPES:
+            raise DataValidationError(f"Invalid filter: unknown field {name}")
+        if value is not None and not is_a(value, STATUS_FILTER_TYPES[name]):
+            raise DataValidationError(f"Invalid filter: {name} must be a {STATUS_FILTER_TYPES[name].__name__}")
+    ids = data.get('ids')
+    if ids is not None and not all(is_a(id_, int) for id_ in ids):
+        raise DataValidationError("Invalid filter: ids must be integers")
+    filters = {
+        'promotion_type': data.get('type'),
+        'min_value': data.get('min_value'),
+        'max_value': data.get('max_value'),
+        'name': data.get('name'),
+    }
+    for name in ('expires_before', 'expires_after'):
+        try:
+            filters[name] = None if data.get(name) is None else date.fromisoformat(data[name])
+        except ValueError as error:
+            raise DataValidationError(f"Invalid filter: {name} must be an ISO date") from error
+    return ids, filters, bool(data.get('dry_run'))
+
+
+def is_a(value, kind: type) -> bool:
+    """True when a JSON value has a type, telling booleans apart from integers"""
+    return isinstance(value, kind) and (kind is bool or not isinstance(value, bool))
+
+
+def read_operations() -> list:
+    """Reads the bulk operations from a JSON array or newline-delimited JSON body"""
+    if request.mimetype == 'application/x-ndjson':
+        try:
+            return [json.loads(line) for line in request.get_data(as_text=True).splitlines()
+                    if line.strip()]
+        except ValueError as error:
+            raise DataValidationError(f"Invalid JSON line: {error}") from error
+    operations = request.get_json()
+    if not isinstance(operations, list):
+        raise DataValidationError("Bulk operations must be a JSON array")
+    return operations
@@ -0,0 +1,377 @@
+"""
+Active Promotion Snapshot
+
+Keeps the active Promotions of a worker in memory, indexed by id and by
+type, so the list of active Promotions and the cart evaluation engine
+are served without querying the database.
+
+The snapshot is loaded on first use and then kept current incrementally.
+A commit that changes Promotions sends their ids on the Postgres channel
+"promotion_changes" as part of its transaction, and every worker reloads
+just those rows. A background thread LISTENs on the channel and also
+polls for the rows updated since the last refresh, so a missed
+notification, a write from outside the service or a database without
+LISTEN/NOTIFY is picked up within a poll interval.
+
+The notified ids are also evicted from the per-process cache of
+Promotion.find(), which would otherwise serve the other workers the old
+Promotion and its ETag until the entry expires.
+"""
+import logging
+import select
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import timedelta
+from sqlalchemy import event, func, text
+from sqlalchemy import select as select_rows
+from sqlalchemy.orm import Session
+from service.common.cache import LRUCache
+from service.models import PROMOTION_FIELDS, Promotion, db, invalidate_cache, on_change, pending_changes
+
+logger = logging.getLogger("flask.app")
+
+CHANNEL = "promotion_changes"
+
+# Notifications longer than this ask for a full reload, Postgres
+# rejects payloads of 8000 bytes or more
+MAX_PAYLOAD = 7900
+
+# A row of the snapshot with the fields of serialize() in order
+ActiveRow = namedtuple("ActiveRow", PROMOTION_FIELDS)
+
+EMPTY_FINGERPRINT = (0, None, None, None)
+
+
+def type_name(promotion_type):
+    """Returns the name of a PromotionType given as a member or a name"""
+    return getattr(promotion_type, "name", promotion_type)
+
+
+class SnapshotState:
+    """One version of the active Promotions, never changed once built"""
+
+    def __init__(self, version, rows, meta, watermark):
+        """
+        Args:
+            version (int): a number that grows every time the snapshot changes
+            rows (dict): the ActiveRow of each active Promotion by id
+            meta (dict): the version and last update time of each of them by id
+            watermark (datetime): the latest update read from the database
+        """
+        self.version = version
+        self.rows = rows
+        self.meta = meta
+        self.watermark = watermark
+        self.ids = sorted(rows)
+        self.ids_by_type = {}
+        for promotion_id in self.ids:
+            self.ids_by_type.setdefault(rows[promotion_id].type.name, []).append(promotion_id)
+        self.fingerprints = {None: self._summarize(self.ids)}
+        for promotion_type, ids in self.ids_by_type.items():
+            self.fingerprints[promotion_type] = self._summarize(ids)
+
+    def _summarize(self, ids) -> tuple:
+        """Returns the count, largest id, sum of versions and last update of some rows"""
+        if not ids:
+            return EMPTY_FINGERPRINT
+        return (len(ids), ids[-1], sum(self.meta[id_][0] for id_ in ids),
+                max(self.meta[id_][1] for id_ in ids))
+
+    def fingerprint(self, promotion_type=None) -> tuple:
+        """Returns what Promotion.fingerprint(status=True) would for the same Promotions"""
+        return self.fingerprints.get(type_name(promotion_type), EMPTY_FINGERPRINT)
+
+    def page(self, limit=None, after=None, promotion_type=None) -> list:
+        """
+        Returns the rows of a page of active Promotions sorted by id
+
+        Args:
+            limit (int): the largest number of rows to return, all of them if None
+            after (int): only return the Promotions with a larger id
+            promotion_type (PromotionType or str): only return the Promotions of this type
+        """
+        ids = self.ids if promotion_type is None else self.ids_by_type.get(type_name(promotion_type), [])
+        start = 0 if after is None else bisect_right(ids, after)
+        end = None if limit is None else start + limit
+        return [self.rows[id_] for id_ in ids[start:end]]
+
+    def active(self, on_date) -> list:
+        """Returns the rows of the Promotions that have not expired on a day"""
+        return [row for row in self.rows.values() if row.expiry >= on_date]
+
+
+class ActiveSnapshot:  # pylint: disable=too-many-instance-attributes
+    """The active Promotions of a worker, kept current with the database"""
+
+    def __init__(self, poll_seconds=5, overlap_seconds=5, listen=True):
+        """
+        Args:
+            poll_seconds (float): how often to read the recently updated rows,
+                0 to only read them when the snapshot is used
+            overlap_seconds (float): how far before the last update seen to read
+                again, to cover clocks that disagree and transactions that commit late
+            listen (bool): exchange the changes through Postgres LISTEN/NOTIFY
+        """
+        self.poll_seconds = poll_seconds
+        self.overlap_seconds = overlap_seconds
+        self.listen = listen
+        self.app = None
+        self._state = None
+        self._refreshed_at = 0.0
+        self._lock = threading.RLock()
+        self._pending_lock = threading.Lock()
+        self._pending = set()
+        self._pending_all = False
+        self._changes = 0   # change notifications received
+        self._applied = 0   # of them the snapshot has applied
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        """Configures the snapshot from the Flask app and follows the Promotion changes"""
+        self.app = app
+        self.poll_seconds = app.config["SNAPSHOT_POLL_SECONDS"]
+        self.overlap_seconds = app.config["SNAPSHOT_OVERLAP_SECONDS"]
+        self.listen = app.config["SNAPSHOT_LISTEN"]
+        on_change(self.changed)
+        event.listen(Session, "before_commit", self.notify)
+
+    @property
+    def engine(self):
+        """The database engine of the app"""
+        return db.get_engine(self.app)
+
+    @property
+    def running(self) -> bool:
+        """True while the background thread follows the changes"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def uses_notify(self, bind) -> bool:
+        """True when the changes go through LISTEN/NOTIFY on a database"""
+        return self.listen and bind.dialect.name == "postgresql"
+
+    def current(self) -> SnapshotState:
+        """Returns the latest version of the snapshot, loading or catching it up first"""
+        state = self._state
+        if state is None:
+            state = self.load()
+            self.start()
+        elif self._applied < self._changes:
+            state = self.apply_pending()
+        elif not self.running and time.monotonic() - self._refreshed_at >= self.poll_seconds:
+            state = self.refresh()
+        return state
+
+    ######################################################################
+    #  R E A D I N G   T H E   D A T A B A S E
+    ######################################################################
+
+    @staticmethod
+    def _select():
+        """Returns a select of the fields, version and update time of the Promotions"""
+        table = Promotion.__table__
+        return select_rows(*[table.c[name] for name in PROMOTION_FIELDS],
+                           table.c.version, table.c.last_updated_at)
+
+    def load(self) -> SnapshotState:
+        """Replaces the snapshot with every active Promotion in the database"""
+        table = Promotion.__table__
+        with self._lock:
+            _, _, changes = self._take_pending()  # the rows read next include them
+            with self.engine.connect() as connection:
+                rows = connection.execute(self._select().where(table.c.status)).all()
+                watermark = connection.execute(select_rows(func.max(table.c.last_updated_at))).scalar()
+            logger.info("Loaded %s active Promotions into the snapshot", len(rows))
+            self._refreshed_at = time.monotonic()
+            state = self._update(rows, watermark=watermark, full=True)
+            self._applied = max(self._applied, changes)
+            return state
+
+    def refresh(self) -> SnapshotState:
+        """Catches up with the rows updated since the last refresh"""
+        table = Promotion.__table__
+        with self._lock:
+            state = self._state
+            if state is None:
+                return self.load()
+            query = self._select()
+            if state.watermark is not None:
+                query = query.where(table.c.last_updated_at
+                                    > state.watermark - timedelta(seconds=self.overlap_seconds))
+            with self.engine.connect() as connection:
+                rows = connection.execute(query).all()
+                count = connection.execute(
+                    select_rows(func.count()).select_from(table).where(table.c.status)).scalar()
+            state = self._update(rows, watermark=max((row.last_updated_at for row in rows), default=None))
+            if len(state.rows) != count:
+                # deleted rows leave no trace to catch up with
+                logger.info("Active Promotions were deleted, reloading the snapshot")
+                return self.load()
+            self._refreshed_at = time.monotonic()
+            return state
+
+    def apply(self, ids) -> SnapshotState:
+        """Reloads some Promotions, dropping the ones that are gone or inactive"""
+        table = Promotion.__table__
+        with self._lock:
+            if self._state is None:
+                return self.load()
+            with self.engine.connect() as connection:
+                rows = connection.execute(self._select().where(table.c.id.in_(ids))).all()
+            return self._update(rows, removed=set(ids) - {row.id for row in rows})
+
+    def apply_pending(self) -> SnapshotState:
+        """Reloads the Promotions that changed since the snapshot last did"""
+        # the lock makes a reader wait for changes another thread is applying
+        with self._lock:
+            ids, everything, changes = self._take_pending()
+            try:
+                if everything:
+                    self.load()
+                elif ids:
+                    self.apply(ids)
+            except Exception:
+                self.changed(None)  # reload everything once the database is back
+                raise
+            self._applied = max(self._applied, changes)
+            return self._state
+
+    def _update(self, rows, removed=(), watermark=None, full=False) -> SnapshotState:
+        """Swaps in a new version of the snapshot with some rows read from the database"""
+        state = self._state
+        full = full or state is None
+        active = {} if full else dict(state.rows)
+        meta = {} if full else dict(state.meta)
+        changed = full
+        for promotion_id in removed:
+            changed = active.pop(promotion_id, None) is not None or changed
+            meta.pop(promotion_id, None)
+        for row in rows:
+            if not row.status:
+                changed = active.pop(row.id, None) is not None or changed
+                meta.pop(row.id, None)
+            elif meta.get(row.id) != (row.version, row.last_updated_at):
+                active[row.id] = ActiveRow(*row[:len(PROMOTION_FIELDS)])
+                meta[row.id] = (row.version, row.last_updated_at)
+                changed = True
+        if not full:
+            watermark = max(filter(None, (state.watermark, watermark)), default=None)
+        if not changed and watermark == state.watermark:
+            return state
+        self._state = SnapshotState(state.version + 1 if state else 1, active, meta, watermark)
+        return self._state
+
+    ######################################################################
+    #  C H A N G E   N O T I F I C A T I O N S
+    ######################################################################
+
+    def changed(self, ids):
+        """Change listener that marks the Promotions a commit wrote for reloading"""
+        with self._pending_lock:
+            self._changes += 1
+            if ids is None:
+                self._pending_all = True
+            else:
+                self._pending.update(ids)
+
+    def _take_pending(self) -> tuple:
+        """Returns and forgets the changed ids, whether everything changed and the changes seen"""
+        with self._pending_lock:
+            pending = (self._pending, self._pending_all, self._changes)
+            self._pending, self._pending_all = set(), False
+        return pending
+
+    def notify(self, session):
+        """Sends the ids a transaction changed to every worker when it commits"""
+        if session.in_nested_transaction() or not self.uses_notify(session.get_bind()):
+            return
+        session.flush()  # collect the ids of the last writes too
+        ids = pending_changes(session)
+        if ids == set():
+            return
+        payload = "*" if ids is None else ",".join(str(id_) for id_ in sorted(ids))
+        if len(payload) > MAX_PAYLOAD:
+            payload = "*"
+        # NOTIFY is only delivered if the transaction commits
+        session.connection().execute(text("SELECT pg_notify(:channel, :payload)"),
+                                     {"channel": CHANNEL, "payload": payload})
+
+    def receive(self, payloads):
+        """Applies the notifications sent by the workers to the snapshot and the cache of find()"""
+        for payload in payloads:
+            try:
+                ids = {int(id_) for id_ in payload.split(",")}
+            except ValueError:
+                ids = None  # "*" or a payload sent by hand
+            self.changed(ids)
+            # a shared cache was already cleared by the worker that committed
+            if isinstance(Promotion.cache, LRUCache):
+                invalidate_cache(ids)
+        self.apply_pending()
+
+    ######################################################################
+    #  B A C K G R O U N D   T H R E A D
+    ######################################################################
+
+    def start(self):
+        """Starts following the changes in a background thread"""
+        if self.poll_seconds <= 0 or self.running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="promotion-snapshot", daemon=True)
+        self._thread.start()
+        logger.info("Promotion snapshot following changes, polling every %s seconds", self.poll_seconds)
+
+    def stop(self, timeout=None):
+        """Stops the background thread"""
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        """Follows the changes until stopped, reconnecting after database errors"""
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                if self.uses_notify(self.engine):
+                    connection = self._listen()
+                self._follow(connection)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Promotion snapshot refresh failed: %s", error)
+                self._stopped.wait(self.poll_seconds)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _listen(self):
+        """Opens a connection outside of the pool that LISTENs on the channel"""
+        engine = self.engine
+        args, kwargs = engine.dialect.create_connect_args(engine.url)
+        connection = engine.dialect.connect(*args, **kwargs)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("LISTEN " + CHANNEL)
+        return connection
+
+    def _follow(self, connection):
+        """Applies the notifications as they come and polls every poll_seconds"""
+        self.refresh()  # catch up with what was missed while not listening
+        while not self._stopped.is_set():
+            wait = max(0.0, min(1.0, self._refreshed_at + self.poll_seconds - time.monotonic()))
+            if connection is None:
+                self._stopped.wait(wait)
+            elif select.select([connection], [], [], wait)[0]:
+                connection.poll()
+                payloads = [notification.payload for notification in connection.notifies]
+                connection.notifies.clear()
+                self.receive(payloads)
+                continue
+            if time.monotonic() - self._refreshed_at >= self.poll_seconds:
+                self.refresh()
+
+
+# The snapshot read by the service
+snapshot = ActiveSnapshot()
@@ -0,0 +1,139 @@
+"""
+Promotion Statistics
+
+Counts the Promotions by status, by type and by how soon the active ones
+expire, and summarizes promotion_value and promotion_percent, all with a
+single query of conditional aggregates so a dashboard never downloads the
+list. The result is cached for STATS_CACHE_TTL seconds and cleared by the
+writes this worker commits.
+"""
+import logging
+from datetime import date, timedelta
+from sqlalchemy import and_, case, func
+from sqlalchemy import select as select_rows
+from service.common.cache import LRUCache, create_cache
+from service.models import Promotion, PromotionType, db, on_change
+
+logger = logging.getLogger("flask.app")
+
+# Upper bounds of the buckets of the value distributions, the first bucket
+# has no lower bound and the last one no upper bound
+VALUE_BUCKETS = (5, 10, 25, 50, 100)
+PERCENT_BUCKETS = (10, 25, 50, 75, 100)
+
+# Days ahead of today that bound the expiry buckets of the active Promotions
+EXPIRY_BUCKETS = (7, 30)
+
+
+class PromotionStats:
+    """Aggregate statistics of the Promotions cached between writes"""
+
+    def __init__(self, ttl=10):
+        self.cache = LRUCache(maxsize=8, ttl=ttl)
+
+    def init_app(self, app):
+        """Creates the cache from the Flask app config and clears it on every write"""
+        self.cache = create_cache(app.config, "promotion-stats:", 8, app.config["STATS_CACHE_TTL"])
+        on_change(self.changed)
+
+    def changed(self, ids):  # pylint: disable=unused-argument
+        """Forgets the statistics when Promotions changed"""
+        self.cache.clear()
+
+    def summary(self, on_date=None) -> dict:
+        """
+        Returns the counts and value distributions of the Promotions
+
+        Args:
+            on_date (date): the day the expiry buckets count from, today if None
+
+        Returns:
+            dict: the total, the counts by status, by type and status and by
+                expiry of the active Promotions, and the distributions of
+                promotion_value and promotion_percent
+        """
+        on_date = on_date or date.today()
+        found = self.cache.get(on_date.isoformat())
+        if found is not None:
+            return found
+        logger.info("Processing stats query for %s ...", on_date)
+        aggregates = _aggregates(on_date)
+        row = db.session.execute(select_rows(*[
+            expression.label(f"stat_{index}") for index, expression in enumerate(aggregates.values())
+        ])).one()
+        values = dict(zip(aggregates, row))
+        result = {
+            "as_of": on_date.isoformat(),
+            "total": values["total"],
+            "by_status": {"active": values["active"], "inactive": values["total"] - values["active"]},
+            "by_type": {
+                member.name: {"active": values[(member.name, True)], "inactive": values[(member.name, False)]}
+                for member in PromotionType
+            },
+            "expiring": {name: values[name] for name in expiry_bucket_names()},
+            "promotion_value": _distribution(values, "promotion_value", VALUE_BUCKETS),
+            "promotion_percent": _distribution(values, "promotion_percent", PERCENT_BUCKETS),
+        }
+        self.cache.set(on_date.isoformat(), result)
+        return result
+
+
+def expiry_bucket_names() -> list:
+    """Returns the names of the expiry buckets of the active Promotions"""
+    return ["expired"] + [f"within_{days}_days" for days in EXPIRY_BUCKETS] + ["later"]
+
+
+def _count_where(condition):
+    """Counts the rows that match a condition"""
+    return func.count(case((condition, 1)))
+
+
+def _buckets(bounds) -> list:
+    """Returns the lower and upper bound of each bucket split at the bounds"""
+    return list(zip([None] + list(bounds), list(bounds) + [None]))
+
+
+def _in_bucket(column, lower, upper):
+    """Returns the condition of a column falling in a bucket"""
+    if lower is None:
+        return column < upper
+    if upper is None:
+        return column >= lower
+    return and_(column >= lower, column < upper)
+
+
+def _aggregates(on_date) -> dict:
+    """Returns the aggregate expressions of the statistics keyed by name"""
+    active = Promotion.status
+    aggregates = {"total": func.count(), "active": _count_where(active)}
+    for member in PromotionType:
+        aggregates[(member.name, True)] = _count_where(and_(active, Promotion.type == member))
+        aggregates[(member.name, False)] = _count_where(and_(~active, Promotion.type == member))
+    days = [on_date] + [on_date + timedelta(days=days) for days in EXPIRY_BUCKETS]
+    for name, (lower, upper) in zip(expiry_bucket_names(), _buckets(days)):
+        aggregates[name] = _count_where(and_(active, _in_bucket(Promotion.expiry, lower, upper)))
+    for name, bounds in [("promotion_value", VALUE_BUCKETS), ("promotion_percent", PERCENT_BUCKETS)]:
+        column = getattr(Promotion, name)
+        aggregates[(name, "count")] = func.count(column)
+        aggregates[(name, "min")] = func.min(column)
+        aggregates[(name, "max")] = func.max(column)
+        aggregates[(name, "avg")] = func.avg(column)
+        for index, (lower, upper) in enumerate(_buckets(bounds)):
+            aggregates[(name, index)] = _count_where(_in_bucket(column, lower, upper))
+    return aggregates
+
+
+def _distribution(values, name, bounds) -> dict:
+    """Returns the summary and histogram of a column from the values of the query"""
+    average = values[(name, "avg")]
+    return {
+        "count": values[(name, "count")],
+        "min": values[(name, "min")],
+        "max": values[(name, "max")],
+        "avg": None if average is None else round(float(average), 2),
+        "histogram": [{"from": lower, "to": upper, "count": values[(name, index)]}
+                      for index, (lower, upper) in enumerate(_buckets(bounds))],
+    }
+
+
+stats = PromotionStats()
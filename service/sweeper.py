@@ -0,0 +1,94 @@
+"""
+Expiry Sweeper
+
+Deactivates the Promotions that are still active after they expired
+
+The sweep runs in small batches, each one a single UPDATE committed on
+its own, so it only holds row locks for a moment and skips the rows that
+live requests have locked. It runs from the "flask sweep-expired" command
+or every few seconds in a background thread of each worker.
+"""
+import logging
+import threading
+import time
+from service.models import Promotion, db
+
+logger = logging.getLogger("flask.app")
+
+
+class ExpirySweeper:
+    """Deactivates expired Promotions in bounded batches"""
+
+    def __init__(self, batch_size=1000, pause_seconds=0.1, interval_seconds=0):
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.interval_seconds = interval_seconds
+        self.app = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        """Configures the sweeper from the Flask app and starts it if it has an interval"""
+        self.app = app
+        self.batch_size = app.config["SWEEP_BATCH_SIZE"]
+        self.pause_seconds = app.config["SWEEP_PAUSE_SECONDS"]
+        self.interval_seconds = app.config["SWEEP_INTERVAL_SECONDS"]
+        if self.interval_seconds > 0:
+            self.start()
+
+    def sweep(self, on_date=None, max_batches=None) -> int:
+        """
+        Deactivates the Promotions that expired before a day
+
+        Args:
+            on_date (date): the day to check the expiry against, today if None
+            max_batches (int): stop after this many batches, all of them if None
+
+        Returns:
+            int: the number of Promotions deactivated
+        """
+        count = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            deactivated = len(Promotion.deactivate_expired(self.batch_size, on_date))
+            count += deactivated
+            batches += 1
+            if deactivated < self.batch_size:
+                break
+            self._stopped.wait(self.pause_seconds)  # let live traffic through
+        logger.info("Expiry sweep deactivated %s Promotions in %s batches", count, batches)
+        return count
+
+    def start(self):
+        """Starts sweeping in a background thread every interval"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="expiry-sweeper", daemon=True)
+        self._thread.start()
+        logger.info("Expiry sweeper started, sweeping every %s seconds", self.interval_seconds)
+
+    def stop(self, timeout=None):
+        """Stops the background thread after the batch it is sweeping"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        """Sweeps until stopped, keeping the thread alive through database errors"""
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            with self.app.app_context():
+                try:
+                    self.sweep()
+                except Exception as error:  # pylint: disable=broad-except
+                    logger.error("Expiry sweep failed: %s", error)
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            self._stopped.wait(max(0.0, self.interval_seconds - (time.monotonic() - started)))
+
+
+# The sweeper started by the service
+sweeper = ExpirySweeper()
@@ -1,10 +1,10 @@
 """
 Test Factory to make fake objects for testing
 """
-from datetime import date
+from datetime import date, datetime, timezone
 
 import factory
-from factory.fuzzy import FuzzyChoice, FuzzyDate, FuzzyInteger
+from factory.fuzzy import FuzzyChoice, FuzzyDate, FuzzyDateTime, FuzzyInteger
 from service.models import Promotion, PromotionType
 
 
@@ -26,4 +26,4 @@ class PromotionFactory(factory.Factory):
     status = FuzzyChoice(choices=[True, False])
     expiry = FuzzyDate(date(2008, 1, 1))
     created_at = FuzzyDate(date(2008, 1, 1))
-    last_updated_at = FuzzyDate(date(2008, 1, 1))
+    last_updated_at = FuzzyDateTime(datetime(2008, 1, 1, tzinfo=timezone.utc))
@@ -0,0 +1,52 @@
+"""
+Test helpers that count the SQL statements sent to the database
+
+Only the statements of the thread that counts them are recorded, so the
+polls of the snapshot thread and the sweeper never show up in the counts.
+"""
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryCounter:
+    """Records the statements the current thread sends while it is entered"""
+
+    def __init__(self):
+        self.statements = []
+        self._thread = threading.current_thread()
+
+    def __enter__(self):
+        event.listen(Engine, "after_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *_):
+        event.remove(Engine, "after_cursor_execute", self._record)
+
+    def __len__(self):
+        return len(self.statements)
+
+    def _record(self, _conn, _cursor, statement, *_):
+        if threading.current_thread() is self._thread:
+            self.statements.append(" ".join(statement.split()))
+
+
+def count_queries(function) -> int:
+    """Returns the number of statements a function sent to the database"""
+    with QueryCounter() as counter:
+        function()
+    return len(counter)
+
+
+class QueryBudgetMixin:  # pylint: disable=too-few-public-methods
+    """Adds assertMaxQueries() to a TestCase"""
+
+    @contextmanager
+    def assertMaxQueries(self, maximum: int):  # pylint: disable=invalid-name
+        """Fails when the block sends more than maximum statements, listing them"""
+        with QueryCounter() as counter:
+            yield counter
+        if len(counter) > maximum:
+            self.fail(f"{len(counter)} queries sent, expected at most {maximum}:\n" +  # pylint: disable=no-member
+                      "\n".join(f"  {statement}" for statement in counter.statements))
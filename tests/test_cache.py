@@ -0,0 +1,142 @@
+"""
+Test cases for the Cache Backends
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+from unittest import TestCase
+from service.common.cache import LRUCache, SharedCache, FakeCacheServer, create_cache
+
+
+class FakeClock:  # pylint: disable=too-few-public-methods
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(TestCase):
+    """ Test Cases for the per-process LRU Cache """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LRUCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_get_and_set(self):
+        """It should return cached values and count hits and misses"""
+        self.assertIsNone(self.cache.get("1"))
+        self.cache.set("1", {"name": "Sale"})
+        self.assertEqual(self.cache.get("1"), {"name": "Sale"})
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        self.cache.set("1", 1)
+        self.cache.set("2", 2)
+        self.cache.get("1")
+        self.cache.set("3", 3)
+        self.assertIsNone(self.cache.get("2"))
+        self.assertEqual(self.cache.get("1"), 1)
+        self.assertEqual(self.cache.get("3"), 3)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_expire_after_ttl(self):
+        """It should not return entries older than the time to live"""
+        self.cache.set("1", 1)
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get("1"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_delete_and_clear(self):
+        """It should remove invalidated entries"""
+        self.cache.set("1", 1)
+        self.cache.set("2", 2)
+        self.cache.delete("1")
+        self.cache.delete("missing")
+        self.assertIsNone(self.cache.get("1"))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("2"))
+        self.assertEqual(self.cache.stats()["invalidations"], 2)
+
+    def test_add_with_ttl(self):
+        """It should only add entries for new or expired keys, with their own time to live"""
+        self.assertTrue(self.cache.add("1", 1, ttl=2))
+        self.assertFalse(self.cache.add("1", 2))
+        self.assertEqual(self.cache.get("1"), 1)
+        self.clock.now = 2
+        self.assertTrue(self.cache.add("1", 3))
+        self.clock.now = 11
+        self.assertEqual(self.cache.get("1"), 3)
+        self.cache.set("2", 2, ttl=20)
+        self.clock.now = 21
+        self.assertEqual(self.cache.get("2"), 2)
+
+
+class TestSharedCache(TestCase):
+    """ Test Cases for the Shared Cache on a fake server """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.server = FakeCacheServer(clock=self.clock)
+        self.cache = SharedCache(self.server, ttl=10, prefix="test:")
+
+    def test_get_and_set(self):
+        """It should share cached values through the server"""
+        self.assertIsNone(self.cache.get("1"))
+        self.cache.set("1", {"name": "Sale"})
+        other = SharedCache(self.server, ttl=10, prefix="test:")
+        self.assertEqual(other.get("1"), {"name": "Sale"})
+        self.assertEqual(self.cache.stats()["misses"], 1)
+        self.assertEqual(other.stats()["hits"], 1)
+
+    def test_expire_after_ttl(self):
+        """It should let the server expire entries"""
+        self.cache.set("1", 1)
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get("1"))
+
+    def test_delete_and_clear(self):
+        """It should only clear the entries under its prefix"""
+        other = SharedCache(self.server, ttl=10, prefix="other:")
+        other.set("1", 1)
+        self.cache.set("1", 1)
+        self.cache.set("2", 2)
+        self.cache.delete("1")
+        self.assertIsNone(self.cache.get("1"))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("2"))
+        self.assertEqual(other.get("1"), 1)
+
+    def test_add_with_ttl(self):
+        """It should only add entries for new or expired keys, with their own time to live"""
+        other = SharedCache(self.server, ttl=10, prefix="test:")
+        self.assertTrue(self.cache.add("1", 1, ttl=2))
+        self.assertFalse(other.add("1", 2))
+        self.assertEqual(other.get("1"), 1)
+        self.clock.now = 2
+        self.assertTrue(other.add("1", 3))
+        self.assertEqual(self.cache.get("1"), 3)
+        self.cache.set("2", 2, ttl=20)
+        self.clock.now = 21
+        self.assertEqual(self.cache.get("2"), 2)
+
+
+class TestCreateCache(TestCase):
+    """ Test Cases for choosing the Cache backend """
+
+    def test_create_cache(self):
+        """It should create the configured backend"""
+        cache = create_cache({}, "test:", 10, 5)
+        self.assertIsInstance(cache, LRUCache)
+        self.assertEqual((cache.maxsize, cache.ttl), (10, 5))
+        cache = create_cache({"CACHE_BACKEND": "fake"}, "test:", 10, 5)
+        self.assertIsInstance(cache, SharedCache)
+        self.assertRaises(ValueError, create_cache, {"CACHE_BACKEND": "bogus"}, "test:", 10, 5)
@@ -5,7 +5,7 @@ import os
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service.common.cli_commands import db_create, sweep_expired
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +21,14 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.sweeper')
+    def test_sweep_expired(self, sweeper_mock):
+        """It should call the sweep-expired command"""
+        sweeper_mock.sweep.return_value = 7
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(sweep_expired, ["--batch-size", "50", "--max-batches", "2"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Deactivated 7 expired promotions", result.output)
+            self.assertEqual(sweeper_mock.batch_size, 50)
+            sweeper_mock.sweep.assert_called_once_with(max_batches=2)
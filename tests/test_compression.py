@@ -0,0 +1,87 @@
+"""
+Test cases for the Response Compression
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import gzip
+import json
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+from service import app
+from service.common import compression
+from service.common.compression import compress_response, compress_stream
+
+BODY = json.dumps([{"id": str(n), "name": "Summer Sale", "status": True} for n in range(100)])
+CONFIG = {"COMPRESS_GZIP_LEVEL": 6, "COMPRESS_BROTLI_QUALITY": 4}
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(TestCase):
+    """ Test Cases for compressing the responses """
+
+    def _compress(self, accept_encoding=None, body=BODY, **kwargs):
+        """Returns a response with a body after compressing it for a request"""
+        headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+        with app.test_request_context("/api/promotions", headers=headers):
+            response = app.response_class(body, mimetype=kwargs.pop("mimetype", "application/json"), **kwargs)
+            response.set_etag("abc")
+            return compress_response(response)
+
+    def test_gzip(self):
+        """It should gzip large responses when the client accepts it"""
+        response = self._compress("gzip")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.vary)
+        self.assertEqual(gzip.decompress(response.get_data()).decode("utf-8"), BODY)
+        self.assertEqual(response.content_length, len(response.get_data()))
+        self.assertLess(response.content_length, len(BODY))
+
+    @skipIf(compression.brotli is None, "brotli is not installed")
+    def test_brotli(self):
+        """It should prefer brotli unless the client prefers gzip"""
+        response = self._compress("gzip, deflate, br")
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(compression.brotli.decompress(response.get_data()).decode("utf-8"), BODY)
+        response = self._compress("gzip, br;q=0.5")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+    def test_without_brotli(self):
+        """It should fall back to gzip when brotli is not installed"""
+        with patch.object(compression, "brotli", None):
+            response = self._compress("br, gzip")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+    def test_weak_etag(self):
+        """It should make the entity tag of compressed responses weak"""
+        self.assertEqual(self._compress("gzip").get_etag(), ("abc", True))
+        self.assertEqual(self._compress().get_etag(), ("abc", False))
+
+    def test_not_compressed(self):
+        """It should send small, unaccepted, failed and binary responses as they are"""
+        for response in [
+            self._compress(),
+            self._compress("identity"),
+            self._compress("gzip;q=0"),
+            self._compress("gzip", body="[]"),
+            self._compress("gzip", status=400),
+            self._compress("gzip", mimetype="image/png"),
+        ]:
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertEqual(len(response.get_data()), response.content_length)
+
+    def test_compress_stream(self):
+        """It should compress a stream of chunks as they are produced"""
+        chunks = [line.encode("utf-8") for line in BODY.split(",")]
+        data = b"".join(compress_stream(chunks, "gzip", CONFIG))
+        self.assertEqual(gzip.decompress(data), b"".join(chunks))
+
+    @skipIf(compression.brotli is None, "brotli is not installed")
+    def test_compress_stream_brotli(self):
+        """It should compress a stream of chunks with brotli"""
+        chunks = [line.encode("utf-8") for line in BODY.split(",")]
+        data = b"".join(compress_stream(iter(chunks), "br", CONFIG))
+        self.assertEqual(compression.brotli.decompress(data), b"".join(chunks))
@@ -0,0 +1,94 @@
+"""
+Test cases for the Log Handlers
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import io
+import json
+import logging
+from unittest import TestCase
+from flask import Flask, current_app
+from service.common import log_handlers
+from service.common.log_handlers import REQUEST_ID_HEADER, init_logging, stop_logging
+
+SERVER_LOGGER = "test.gunicorn.error"
+
+
+######################################################################
+#  L O G   H A N D L E R S   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """ Test Cases for the log setup """
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        server_logger = logging.getLogger(SERVER_LOGGER)
+        server_logger.handlers = [logging.StreamHandler(self.stream)]
+        server_logger.setLevel(logging.INFO)
+
+    def _app(self, **settings) -> Flask:
+        """Returns an app that logs the way the service does, with a route that logs"""
+        app = Flask("logtest")
+        app.config.update({"LOG_FORMAT": "json", "LOG_QUEUE": True, "LOG_SAMPLE_RATE": 1.0, **settings})
+        init_logging(app, SERVER_LOGGER)
+
+        @app.route("/hello")
+        def hello():  # pylint: disable=unused-variable
+            current_app.logger.info("Hello %s", "world")
+            try:
+                raise ValueError("boom")
+            except ValueError:
+                current_app.logger.exception("Failed")
+            return "hello"
+
+        self.addCleanup(stop_logging, app)
+        return app
+
+    def _lines(self, app) -> list:
+        """Returns the lines written so far"""
+        stop_logging(app)
+        return self.stream.getvalue().splitlines()
+
+    def test_json_lines(self):
+        """It should write one JSON object per record with the request id"""
+        app = self._app()
+        response = app.test_client().get("/hello", headers={REQUEST_ID_HEADER: "abc-123"})
+        self.assertEqual(response.headers[REQUEST_ID_HEADER], "abc-123")
+        entries = [json.loads(line) for line in self._lines(app)]
+        self.assertEqual(entries[0]["message"], "Logging handler established")
+        self.assertIsNone(entries[0]["request_id"])
+        hello, failed = entries[1:]
+        self.assertEqual(hello["message"], "Hello world")
+        self.assertEqual(hello["level"], "INFO")
+        self.assertEqual(hello["request_id"], "abc-123")
+        self.assertEqual(failed["level"], "ERROR")
+        self.assertIn("ValueError: boom", failed["exception"])
+
+    def test_request_id(self):
+        """It should give every request a new id unless it sent a usable one"""
+        client = self._app().test_client()
+        first = client.get("/hello").headers[REQUEST_ID_HEADER]
+        second = client.get("/hello").headers[REQUEST_ID_HEADER]
+        self.assertEqual(len(first), 32)
+        self.assertNotEqual(first, second)
+        too_long = "x" * (log_handlers.MAX_REQUEST_ID_LENGTH + 1)
+        self.assertNotEqual(client.get("/hello", headers={REQUEST_ID_HEADER: too_long}).headers[REQUEST_ID_HEADER],
+                            too_long)
+
+    def test_sampling(self):
+        """It should drop the INFO lines of the requests left out of the sample but keep the errors"""
+        app = self._app(LOG_SAMPLE_RATE=0.0)
+        app.test_client().get("/hello")
+        messages = [json.loads(line)["message"] for line in self._lines(app)]
+        self.assertEqual(messages, ["Logging handler established", "Failed"])
+
+    def test_text_without_queue(self):
+        """It should write the text format from the request thread when the queue is off"""
+        app = self._app(LOG_FORMAT="text", LOG_QUEUE=False)
+        self.assertNotIn("log_listener", app.extensions)
+        app.test_client().get("/hello")
+        lines = self.stream.getvalue().splitlines()
+        self.assertRegex(lines[1], r"^\[.+\] \[INFO\] \[test_log_handlers\] Hello world$")
+        self.assertIn("Traceback", self.stream.getvalue())